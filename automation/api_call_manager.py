@@ -1,32 +1,61 @@
 # api_call_manager module
 # Module holds the class => APICallManager - manages the api interface to fetch provider id for a given study id
 # Class responsible for all api related interactions with both the study builder and the odc account service including
-# the api call, data fetch, json file dict read and search for data collection
+# the api call, data fetch, json file dict read and search for data collection, requests is only imported once a
+# session is created
 #
 import json
-import requests
 import logging
 
+from metrics_manager import registry as metrics
+
 
 class APICallManager(object):
-    def __init__(self):
+    def __init__(self, session=None, timeout=None):
         self.key_id = 'id'
         self.key_name = 'name'
         self.key_campaigns = 'campaigns'
         self.start_date = 'startDate'
         self.end_date = 'endDate'
+        self.session = session if session is not None else self.create_session()
+        self.timeout = timeout
         self.logger = logging.getLogger(__name__)
 
+    # Creates a keep-alive session whose connection pool is shared by all api calls, retrying failed calls with
+    # an exponential backoff
+    #
+    @staticmethod
+    def create_session(pool_size=10, retries=3, backoff_factor=0.5):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        retry = Retry(total=retries, backoff_factor=backoff_factor, status_forcelist=(429, 500, 502, 503, 504),
+                      allowed_methods=frozenset(['GET']))
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
     # Launch the api call to return a json dictionary to be searched for required data
     #
     def api_call(self, api_url, arg):
         try:
-            response = requests.get("{}{}".format(api_url, arg))
+            response = self.session.get("{}{}".format(api_url, arg), timeout=self.timeout)
+            # count the retries urllib3 made before this response
+            retries = getattr(response.raw, 'retries', None)
+            if retries is not None and retries.history:
+                metrics.increment('api_retries', len(retries.history))
+            # an unknown id is a valid answer with nothing in it, not an api failure
+            if response.status_code == 404:
+                return {}
+            response.raise_for_status()
+            call_dict = response.json()
         except Exception as e:
             self.logger.error("Failed to create a response object => {}".format(e))
             return None
         else:
-            call_dict = response.json()
             return call_dict
 
     # Returns the parent company id value from api return json dict
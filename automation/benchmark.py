@@ -0,0 +1,166 @@
+# benchmark module
+# Responsible for running the full process_manager end to end against the offline stand-in backends at several
+# synthetic ticket volumes, measuring the wall-clock time, the calls made to each service and the peak memory of
+# each run, then writing the measurements as a table to the console and as json to a results file. With --nodes above
+# one, that many offline nodes share the tickets through one lease database and the labelled Jira writes beyond one
+# per ticket are counted. With --engine local the queries run as SQL on the embedded SQLite engine over the synthetic
+# transactions instead of being answered by the Qubole stand-in, with --summary y also maintaining and reading the
+# summary table there.
+# With --fixtures the recorded tickets, api responses and provider dates of the fixture file are replayed in every run
+# alongside the synthetic tickets, --sizes 0 replays the fixtures alone.
+# The --import-budget check instead times a fresh 'import main' and fails if it runs over the budget or loads any of the
+# heavy dependencies that are only needed once a stage has work to do.
+# Usage: python benchmark.py [--sizes 10 100 1000] [--mode ticket|batch|store] [--pipeline y|n]
+#                            [--latency service=seconds ...] [--failure service=rate ...] [--nodes 1]
+#                            [--engine hive|local] [--summary y|n] [--fixtures file.json] [--output file.json]
+#        python benchmark.py --import-budget milliseconds
+#
+import subprocess
+import argparse
+import tempfile
+import tracemalloc
+import threading
+import logging
+import shutil
+import json
+import time
+import sys
+import os
+
+import data_crawler_manager
+from main import read_config
+from offline_backends import OfflineBackend, offline_manager, FIXTURE_FILE
+from local_sql_engine import LocalSqlEngine
+from metrics_manager import registry as metrics
+
+# dependencies loaded by the stage that uses them, never by importing main
+HEAVY_MODULES = ['qds_sdk', 'jira', 'requests', 'urllib3', 'smtplib', 'numpy']
+
+
+# Runs one offline process_manager per node for the given ticket count, the nodes sharing one lease database when
+# there are several, with the recorded fixtures replayed alongside when a fixture file is given, returns the
+# measurements
+#
+def run_benchmark(ticket_count, config_params, latency, failure_rate, seed=0, nodes=1, fixture_file=None):
+    work_dir = tempfile.mkdtemp(prefix='rdc_benchmark_')
+    try:
+        backend = OfflineBackend(latency, failure_rate, seed)
+        if fixture_file is not None:
+            backend.load_fixtures(fixture_file)
+        backend.synthesize(ticket_count, data_crawler_manager.today_date)
+        # the local engine's database is loaded once from the synthetic transactions and shared by every node
+        local_db_path = os.path.join(work_dir, 'local_transactions.db')
+        if config_params['query_engine'] == 'local':
+            LocalSqlEngine.load(local_db_path, backend.provider_dates)
+        managers = []
+        for node in range(1, nodes + 1):
+            # each node keeps its own local files, only the lease database is shared
+            node_dir = os.path.join(work_dir, 'node-{}'.format(node))
+            os.mkdir(node_dir)
+            params = dict(config_params)
+            params.update(study_url='offline://study/', account_url='offline://account/',
+                          coverage_store_path=os.path.join(node_dir, 'coverage_store.db'),
+                          api_cache_path=os.path.join(node_dir, 'api_cache.db'),
+                          writeback_path=os.path.join(node_dir, 'jira_pending.json'),
+                          journal_path=os.path.join(node_dir, 'run_journal.db'), local_db_path=local_db_path,
+                          summary_registry_path=os.path.join(node_dir, 'summary_registry.db'),
+                          readiness_history_path=os.path.join(node_dir, 'readiness_history.db'),
+                          lease_path=os.path.join(work_dir, 'ticket_leases.db'), lease_node='node-{}'.format(node))
+            if nodes > 1:
+                params['lease_enabled'] = 'y'
+            managers.append(offline_manager(backend, params))
+
+        metrics.reset()
+        tracemalloc.start()
+        started = time.perf_counter()
+        threads = [threading.Thread(target=manager.process_manager, name="Node-{}".format(node + 1))
+                   for node, manager in enumerate(managers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall_clock = time.perf_counter() - started
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        completed = set(ticket_key for manager in managers for ticket_key in manager.jira_pars.comments)
+        return {'tickets': len(backend.tickets), 'nodes': nodes, 'wall_clock_seconds': round(wall_clock, 3),
+                'peak_memory_mb': round(peak_memory / 1048576.0, 2),
+                'queued_tickets': sum(len(manager.tickets_iter) for manager in managers),
+                'completed_tickets': len(completed),
+                'duplicate_writes': sum(count - 1 for count in backend.labelled_writes.values()),
+                'calls': dict(sorted(backend.calls.items())), 'metrics': metrics.summary()}
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+# Times 'import main' in a fresh interpreter, returns the milliseconds taken, the heavy modules it loaded and whether
+# it kept within the budget
+#
+def import_check(budget_ms):
+    script = ("import sys, time, json; started = time.perf_counter(); import main; "
+              "print(json.dumps({{'import_ms': round((time.perf_counter() - started) * 1000, 1), "
+              "'heavy_modules': [name for name in {} if name in sys.modules]}}))".format(HEAVY_MODULES))
+    result = json.loads(subprocess.run([sys.executable, '-c', script], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout)
+    result.update(budget_ms=budget_ms, passed=result['import_ms'] <= budget_ms and not result['heavy_modules'])
+    return result
+
+
+# Parses 'service=value' pairs into a dictionary of floats
+#
+def service_values(pairs):
+    return {pair.split('=')[0]: float(pair.split('=')[1]) for pair in pairs or []}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end to end benchmark of the transaction data crawler")
+    parser.add_argument('--config', default='config.ini')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--mode', choices=['ticket', 'batch', 'store'])
+    parser.add_argument('--pipeline', choices=['y', 'n'])
+    parser.add_argument('--latency', nargs='*', default=['jira=0.05', 'api=0.01', 'qubole=0.05', 'email=0.02'])
+    parser.add_argument('--failure', nargs='*', default=[])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--nodes', type=int, default=1)
+    parser.add_argument('--engine', choices=['hive', 'local'], default='hive')
+    parser.add_argument('--summary', choices=['y', 'n'], default='n')
+    parser.add_argument('--fixtures', nargs='?', const=FIXTURE_FILE)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--import-budget', type=float)
+    args = parser.parse_args()
+
+    if args.import_budget is not None:
+        result = import_check(args.import_budget)
+        print(json.dumps(result))
+        sys.exit(0 if result['passed'] else 1)
+
+    logging.basicConfig(level=logging.WARNING)
+    config, config_params = read_config(args.config)
+    if args.mode:
+        config_params['query_mode'] = args.mode
+    if args.pipeline:
+        config_params['pipeline_enabled'] = args.pipeline
+    # the Qubole stand-in answers the hive dialect queries of the transaction table only, the local engine runs its own
+    config_params.update(query_engine=args.engine, interactive_engine='',
+                         summary_enabled=args.summary if args.engine == 'local' else 'n')
+
+    results = []
+    print("{:>8} {:>10} {:>10} {:>8} {:>10} {:>10}  {}".format('tickets', 'seconds', 'peak MB', 'queued', 'completed',
+                                                                 'duplicates', 'calls'))
+    for ticket_count in args.sizes:
+        result = run_benchmark(ticket_count, config_params, service_values(args.latency),
+                               service_values(args.failure), args.seed, args.nodes, args.fixtures)
+        results.append(result)
+        print("{tickets:>8} {wall_clock_seconds:>10} {peak_memory_mb:>10} {queued_tickets:>8} "
+              "{completed_tickets:>10} {duplicate_writes:>10}  {calls}".format(**result))
+
+    with open(args.output, 'w') as target:
+        target.write(json.dumps({'query_mode': config_params['query_mode'],
+                                 'pipeline': config_params['pipeline_enabled'], 'engine': args.engine,
+                                 'summary': config_params['summary_enabled'], 'fixtures': args.fixtures,
+                                 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+# command_poller module
+# Module holds the class => CommandPoller - manages the status polling of all in-flight Qubole commands
+# Class responsible for tracking every outstanding command id from one thread, checking the due commands in a single
+# sweep with a backoff that grows with each command's runtime, waking the waiting consumer once a command finishes
+# and cancelling any command that runs past its deadline
+#
+import threading
+import time
+import logging
+
+from metrics_manager import registry as metrics
+
+
+class CommandPoller(object):
+    def __init__(self, min_interval, max_interval, backoff_ratio, deadline_seconds):
+        self.min_interval = float(min_interval)
+        self.max_interval = float(max_interval)
+        self.backoff_ratio = float(backoff_ratio)
+        self.deadline_seconds = float(deadline_seconds)
+        self.commands = {}
+        self.condition = threading.Condition()
+        self.thread = None
+        self.checks = 0
+        self.logger = logging.getLogger(__name__)
+
+    # Registers a command id with the poller along with the qds_sdk command class it is polled through, a Hive command
+    # when none is given, starting the polling thread on first use
+    #
+    def register(self, command_id, command_class=None):
+        now = time.time()
+        with self.condition:
+            self.commands[command_id] = {'submitted': now, 'next_check': now + self.min_interval, 'status': None,
+                                         'queue_seconds': None, 'done': threading.Event(),
+                                         'command_class': command_class}
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.poll, name="Poller", daemon=True)
+                self.thread.start()
+            self.condition.notify()
+
+    # Blocks until the command finishes, returns the tuple of (final status, seconds spent waiting in queue)
+    #
+    def wait(self, command_id, command_class=None):
+        with self.condition:
+            if command_id not in self.commands:
+                self.register(command_id, command_class)
+            command = self.commands[command_id]
+        command['done'].wait()
+        with self.condition:
+            self.commands.pop(command_id, None)
+        return command['status'], command['queue_seconds']
+
+    # Polling thread loop, checks every due command in one sweep then sleeps until the next one falls due
+    #
+    def poll(self):
+        while True:
+            with self.condition:
+                pending = {command_id: command for command_id, command in self.commands.items()
+                           if not command['done'].is_set()}
+                if not pending:
+                    self.thread = None
+                    return
+                now = time.time()
+                due = [command_id for command_id, command in pending.items() if command['next_check'] <= now]
+                if not due:
+                    self.condition.wait(min(command['next_check'] for command in pending.values()) - now)
+                    continue
+
+            for command_id in due:
+                self.check(command_id, pending[command_id])
+
+    # Checks a single command's status, completing, cancelling or rescheduling it
+    #
+    def check(self, command_id, command):
+        if command['command_class'] is None:
+            from qds_sdk.commands import HiveCommand
+            command['command_class'] = HiveCommand
+        command_class = command['command_class']
+
+        now = time.time()
+        elapsed = now - command['submitted']
+        try:
+            status = command_class.find(command_id).status
+            self.checks += 1
+            metrics.increment('qubole_status_checks')
+        except Exception as e:
+            self.logger.warning("Status check of command {} failed => {}".format(command_id, e))
+            metrics.increment('qubole_status_check_failures')
+            status = None
+
+        if status is not None and command['queue_seconds'] is None and status != 'waiting':
+            command['queue_seconds'] = elapsed
+
+        if status is not None and command_class.is_done(status):
+            self.finish(command, status)
+        elif elapsed > self.deadline_seconds:
+            self.logger.error("Command {} exceeded its {:.0f}s deadline and is being cancelled"
+                              .format(command_id, self.deadline_seconds))
+            try:
+                command_class.cancel_id(command_id)
+            except Exception as e:
+                self.logger.error("Cancel of command {} failed => {}".format(command_id, e))
+            metrics.increment('qubole_deadline_cancels')
+            self.finish(command, 'cancelled')
+        else:
+            # backs off in proportion to the runtime so far, long running commands are checked less often
+            command['next_check'] = now + max(self.min_interval, min(self.max_interval, elapsed * self.backoff_ratio))
+
+    # Records the final status and wakes the waiting consumer
+    #
+    def finish(self, command, status):
+        if command['queue_seconds'] is None:
+            command['queue_seconds'] = time.time() - command['submitted']
+        command['status'] = status
+        command['done'].set()
@@ -0,0 +1,65 @@
+# coverage_analyzer module
+# Module holds the class => CoverageAnalyzer - manages the per-day coverage analysis of ticket windows
+# Class responsible for laying every ticket window out as one row of a day-by-day presence matrix and finding the
+# missing date ranges of all windows at once with vectorized array operations
+#
+import numpy as np
+
+
+class CoverageAnalyzer(object):
+
+    # Returns, for each window, the list of (first missing date, last missing date) ranges as date strings
+    # start_dates, end_dates: window bounds as 'YYYY-MM-DD' strings, both inclusive
+    # window_dates: for each window an array or sequence of the 'YYYY-MM-DD' dates that have transactions
+    #
+    @staticmethod
+    def find_gaps(start_dates, end_dates, window_dates):
+        if not start_dates:
+            return []
+        starts = np.array(start_dates, dtype='datetime64[D]')
+        lengths = np.maximum((np.array(end_dates, dtype='datetime64[D]') - starts).astype(np.int64) + 1, 0)
+        width = int(lengths.max())
+
+        # flatten every window's dates into one array with its window index alongside
+        date_arrays = [np.asarray(dates, dtype='datetime64[D]') for dates in window_dates]
+        rows = np.repeat(np.arange(len(date_arrays)), [len(dates) for dates in date_arrays])
+        offsets = (np.concatenate(date_arrays) - starts[rows]).astype(np.int64) if len(rows) else \
+            np.zeros(0, dtype=np.int64)
+        in_range = (offsets >= 0) & (offsets < lengths[rows])
+
+        # day-by-day presence matrix, one row per window, then the days inside each window that are not present
+        present = np.zeros((len(starts), width), dtype=bool)
+        present[rows[in_range], offsets[in_range]] = True
+        missing = (np.arange(width) < lengths[:, None]) & ~present
+
+        # a run of missing days starts where the padded row steps 0 -> 1 and ends before it steps 1 -> 0
+        edges = np.diff(np.pad(missing.astype(np.int8), ((0, 0), (1, 1))), axis=1)
+        gap_rows, gap_starts = np.nonzero(edges == 1)
+        gap_ends = np.nonzero(edges == -1)[1]
+        first_missing = (starts[gap_rows] + gap_starts).astype(str)
+        last_missing = (starts[gap_rows] + gap_ends - 1).astype(str)
+
+        gaps = [[] for _ in range(len(starts))]
+        for row, first, last in zip(gap_rows.tolist(), first_missing.tolist(), last_missing.tolist()):
+            gaps[row].append((first, last))
+        return gaps
+
+    # Converts a sequence of 'YYYY-MM-DD' strings to a day resolution date array
+    #
+    @staticmethod
+    def to_dates(dates):
+        return np.array(dates, dtype='datetime64[D]')
+
+    # Returns the total number of missing days across a window's gap ranges
+    #
+    @staticmethod
+    def missing_days(gaps):
+        return int(sum((np.datetime64(last) - np.datetime64(first)).astype(int) + 1 for first, last in gaps))
+
+    # Formats a window's gap ranges as a short summary
+    #
+    @staticmethod
+    def gap_summary(gaps):
+        if not gaps:
+            return "none"
+        return ", ".join(first if first == last else "{} to {}".format(first, last) for first, last in gaps)
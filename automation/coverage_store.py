@@ -0,0 +1,107 @@
+# coverage_store module
+# Module holds the class => CoverageStore - manages the local per-provider transaction date coverage store
+# Class responsible for recording which transaction dates have been seen for each provider id, tracking the
+# high-water mark of each provider's scans and answering the day count, min and max date coverage questions, and for
+# recording the missing dates last reported on each incomplete ticket so that a report is only posted when they change
+#
+from datetime import datetime, timedelta
+import threading
+import sqlite3
+import logging
+
+
+class CoverageStore(object):
+    def __init__(self, db_path, rescan_days=7):
+        self.db_path = db_path
+        self.rescan_days = int(rescan_days)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.logger = logging.getLogger(__name__)
+        self.create_tables()
+
+    # Creates the date and scan tables if they do not already exist
+    #
+    def create_tables(self):
+        with self.lock, self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS provider_dates ("
+                              "provider_id TEXT NOT NULL, txn_date TEXT NOT NULL, "
+                              "PRIMARY KEY (provider_id, txn_date))")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS provider_scans ("
+                              "provider_id TEXT PRIMARY KEY, scanned_from TEXT NOT NULL, high_water TEXT)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS gap_reports ("
+                              "ticket_key TEXT PRIMARY KEY, missing_dates TEXT NOT NULL, reported_on TEXT NOT NULL)")
+
+    # Returns the date from which a provider must be scanned to cover a window beginning at start_date, the days up to
+    # rescan_days before the stored high-water mark are scanned again since its day may only have been partially
+    # loaded and earlier days may still arrive late
+    #
+    def scan_start(self, provider_id, start_date):
+        with self.lock:
+            row = self.conn.execute("SELECT scanned_from, high_water FROM provider_scans WHERE provider_id = ?",
+                                    (str(provider_id),)).fetchone()
+        if row is None or start_date < row[0] or row[1] is None:
+            return start_date
+        rescan_from = (datetime.strptime(row[1], '%Y-%m-%d') - timedelta(days=self.rescan_days)).strftime('%Y-%m-%d')
+        return min(max(start_date, rescan_from), row[1])
+
+    # Merges newly scanned transaction dates into the store and advances the provider's high-water mark
+    #
+    def merge(self, provider_id, scanned_from, txn_dates):
+        provider_id = str(provider_id)
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR IGNORE INTO provider_dates (provider_id, txn_date) VALUES (?, ?)",
+                                  [(provider_id, txn_date) for txn_date in txn_dates])
+            row = self.conn.execute("SELECT scanned_from FROM provider_scans WHERE provider_id = ?",
+                                    (provider_id,)).fetchone()
+            if row is not None:
+                scanned_from = min(scanned_from, row[0])
+            high_water = self.conn.execute("SELECT MAX(txn_date) FROM provider_dates WHERE provider_id = ?",
+                                           (provider_id,)).fetchone()[0]
+            self.conn.execute("INSERT OR REPLACE INTO provider_scans (provider_id, scanned_from, high_water) "
+                              "VALUES (?, ?, ?)", (provider_id, scanned_from, high_water))
+
+    # Returns [day count, distinct transaction date count, min date, max date] for a ticket window in the same
+    # shape as the Hive coverage query, None if the provider has no transaction dates within the window
+    #
+    def coverage(self, provider_id, post_period_end_date, start_date):
+        with self.lock:
+            distinct_count, min_date, max_date = self.conn.execute(
+                "SELECT COUNT(*), MIN(txn_date), MAX(txn_date) FROM provider_dates "
+                "WHERE provider_id = ? AND txn_date >= ?", (str(provider_id), start_date)).fetchone()
+        if not distinct_count:
+            return None
+        day_count = (datetime.strptime(post_period_end_date, "%Y-%m-%d") -
+                     datetime.strptime(start_date, "%Y-%m-%d")).days + 1
+        return [str(day_count), str(distinct_count), min_date, max_date]
+
+    # Returns the provider's transaction dates on or after start_date in ascending order
+    #
+    def dates(self, provider_id, start_date):
+        with self.lock:
+            return [row[0] for row in self.conn.execute(
+                "SELECT txn_date FROM provider_dates WHERE provider_id = ? AND txn_date >= ? ORDER BY txn_date",
+                (str(provider_id), start_date))]
+
+    # Records the missing dates reported on a ticket, returns False when the same missing dates were already reported
+    #
+    def report_gaps(self, ticket_key, missing_dates, run_date):
+        with self.lock, self.conn:
+            row = self.conn.execute("SELECT missing_dates FROM gap_reports WHERE ticket_key = ?",
+                                    (ticket_key,)).fetchone()
+            if row is not None and row[0] == missing_dates:
+                return False
+            self.conn.execute("INSERT OR REPLACE INTO gap_reports (ticket_key, missing_dates, reported_on) "
+                              "VALUES (?, ?, ?)", (ticket_key, missing_dates, run_date))
+            return True
+
+    # Drops the gap report of a ticket that has been completed
+    #
+    def clear_gaps(self, ticket_key):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM gap_reports WHERE ticket_key = ?", (ticket_key,))
+
+    # Closes the store connection
+    #
+    def close(self):
+        with self.lock:
+            self.conn.close()
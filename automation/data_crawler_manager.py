@@ -3,26 +3,84 @@
 # Class responsible for overall program management
 #
 from datetime import datetime, timedelta
+import threading
+import math
 import time
+import socket
 import os
-from multiprocessing.dummy import Pool as ThreadPool
-from multiprocessing_logging import install_mp_handler
 import logging
 
 from jira_manager import JiraManager
 from qubole_manager import QuboleManager
+from local_sql_engine import LocalSqlEngine
 from provider_transaction_query import ProviderTransaction
 from api_call_manager import APICallManager
-from email_manager import EmailManager
+from email_manager import EmailManager, EmailDispatcher
+from coverage_store import CoverageStore
+from lookup_cache import LookupCache
+from query_scheduler import QueryScheduler
+from pipeline_manager import PipelineManager
+from command_poller import CommandPoller
+from watermark_index import WatermarkIndex
+from query_coalescer import QueryCoalescer
+from writeback_manager import WriteBackManager
+from lease_manager import LeaseManager
+from resource_pool import ResourcePool
+from run_journal import RunJournal
+from summary_registry import SummaryRegistry
+from readiness_history import ReadinessHistory
+from log_manager import ticket_scope, ticket_logged
+from metrics_manager import registry as metrics
 
 today_date = (datetime.now() - timedelta(hours=6)).strftime('%Y-%m-%d')
 
 
+# Moves the run date forward for a long-running service, returns the run date
+#
+def refresh_today_date():
+    global today_date
+    today_date = (datetime.now() - timedelta(hours=6)).strftime('%Y-%m-%d')
+    return today_date
+
+
 class DataCrawlerManager(object):
-    def __init__(self, config_params):
+    # backend classes, replaced by the local stand-ins of the offline harness
+    jira_class = JiraManager
+    api_class = APICallManager
+    qubole_class = QuboleManager
+    email_class = EmailManager
+
+    def __init__(self, config_params, resources=None):
+        # clients and caches come from the pool, shared with the other managers run in the same process
+        self.resources = resources if resources is not None else ResourcePool()
         self.jira_url = config_params['jira_url']
         self.jira_token = config_params['jira_token']
-        self.jira_pars = JiraManager(self.jira_url, self.jira_token)
+        self.jira_pars = self.resources.get(('jira', self.jira_url, self.jira_token, config_params['jira_page_size']),
+                                            lambda: self.jira_class(self.jira_url, self.jira_token,
+                                                                    config_params['jira_page_size']))
+        self.jira_transition = config_params['jira_transition'] in ['y', 'Y', 'yes', 'true', 'True']
+        # with leases enabled each due ticket is processed by the one node holding its lease
+        self.leases = None
+        if config_params['lease_enabled'] in ['y', 'Y', 'yes', 'true', 'True']:
+            self.leases = self.resources.get(('leases', config_params['lease_path']),
+                                             lambda: LeaseManager(config_params['lease_path'],
+                                                                  config_params['lease_node'] or socket.gethostname(),
+                                                                  config_params['lease_minutes'],
+                                                                  config_params['lease_cooldown_minutes'],
+                                                                  config_params['lease_retention_days']))
+        # with the run journal a restarted run reattaches to its submitted commands and skips its completed writes
+        self.journal = None
+        if config_params['journal_enabled'] in ['y', 'Y', 'yes', 'true', 'True']:
+            self.journal = self.resources.get(('journal', config_params['journal_path']),
+                                              lambda: RunJournal(config_params['journal_path'],
+                                                                 config_params['journal_max_age_hours'],
+                                                                 config_params['journal_retention_days']))
+        self.write_back = self.resources.get(('write_back', config_params['writeback_path']),
+                                             lambda: WriteBackManager(self.jira_pars, config_params['writeback_path'],
+                                                                      config_params['writeback_workers'],
+                                                                      config_params['writeback_retries'],
+                                                                      config_params['writeback_backoff_seconds'],
+                                                                      self.leases, self.journal))
         self.jql_type = config_params['jql_type']
         self.jql_status = config_params['jql_status']
         self.jql_labels = config_params['jql_labels']
@@ -32,35 +90,262 @@ class DataCrawlerManager(object):
         self.jql_text = config_params['jql_text']
         self.qubole_token = config_params['qubole_token']
         self.cluster_label = config_params['cluster_label']
+        self.cluster_labels = [label.strip() for label in self.cluster_label.split(',') if label.strip()]
+        # queries run on the default engine unless estimated small enough for the interactive engine
+        self.query_engine_name = config_params['query_engine']
+        self.interactive_engine = config_params['interactive_engine'].strip()
+        self.interactive_cluster_label = config_params['interactive_cluster_label']
+        self.interactive_max_provider_days = int(config_params['interactive_max_provider_days'])
+        self.local_db_path = config_params['local_db_path']
+        # with the summary enabled the queries of covered providers read the provider and date summary table
+        self.summary_table = config_params['summary_table']
+        self.summary_registry = None
+        if config_params['summary_enabled'] in ['y', 'Y', 'yes', 'true', 'True']:
+            self.summary_registry = self.resources.get(('summary', config_params['summary_registry_path']),
+                                                       lambda: SummaryRegistry(config_params['summary_registry_path'],
+                                                                               config_params['summary_retention_days']))
+        self.summary_refresh_seconds = float(config_params['summary_refresh_minutes']) * 60
+        self.summary_rescan_days = int(config_params['summary_rescan_days'])
+        # with readiness enabled a ticket is not queried before its provider's expected ready date
+        self.readiness = None
+        if config_params['readiness_enabled'] in ['y', 'Y', 'yes', 'true', 'True']:
+            self.readiness = self.resources.get(('readiness', config_params['readiness_history_path']),
+                                                lambda: ReadinessHistory(config_params['readiness_history_path'],
+                                                                         config_params['readiness_lag_quantile'],
+                                                                         config_params['readiness_min_samples'],
+                                                                         config_params['readiness_max_defer_days'],
+                                                                         config_params['readiness_recheck_days'],
+                                                                         config_params['readiness_retention_days']))
+        self.summary_covered = None
+        self.summary_refreshed = 0
+        self.summary_created = False
+        self.max_in_flight = int(config_params['max_in_flight'])
+        self.min_in_flight = int(config_params['min_in_flight'])
+        self.target_queue_seconds = float(config_params['target_queue_seconds'])
+        self.pipeline_enabled = config_params['pipeline_enabled'] in ['y', 'Y', 'yes', 'true', 'True']
+        self.collect_workers = int(config_params['collect_workers'])
+        self.stage_queue_size = int(config_params['stage_queue_size'])
+        self.query_mode = config_params['query_mode']
+        self.gap_check = config_params['gap_check'] in ['y', 'Y', 'yes', 'true', 'True']
+        self.allowed_missing_days = int(config_params['allowed_missing_days'])
+        self.probe_enabled = config_params['probe_enabled'] in ['y', 'Y', 'yes', 'true', 'True']
+        self.prefilter_enabled = config_params['prefilter_enabled'] in ['y', 'Y', 'yes', 'true', 'True']
+        self.prefilter_lookback_days = int(config_params['prefilter_lookback_days'])
+        self.watermarks = None
+        self.prefilter_pending = set()
+        self.coalesce_enabled = config_params['coalesce_enabled'] in ['y', 'Y', 'yes', 'true', 'True']
+        self.coalescer = None
+        self.poller = self.resources.get(('poller', self.qubole_token),
+                                         lambda: CommandPoller(config_params['poll_min_seconds'],
+                                                               config_params['poll_max_seconds'],
+                                                               config_params['poll_backoff_ratio'],
+                                                               float(config_params['command_timeout_minutes']) * 60))
+        self.coverage_store_path = config_params['coverage_store_path']
+        self.coverage_rescan_days = int(config_params['coverage_rescan_days'])
         self.study_url = config_params['study_url']
         self.account_url = config_params['account_url']
+        self.api_workers = int(config_params['api_workers'])
+        self.api_retries = int(config_params['api_retries'])
+        self.api_backoff = float(config_params['api_backoff'])
+        self.api_timeout = float(config_params['api_timeout'])
+        self.api_cache = self.resources.get(('api_cache', config_params['api_cache_path']),
+                                            lambda: LookupCache(config_params['api_cache_path'],
+                                                                config_params['api_cache_ttl_hours'],
+                                                                config_params['api_cache_negative_ttl_hours'],
+                                                                config_params['api_cache_max_entries']))
         self.email_subject = config_params['email_subject']
         self.email_to = config_params['email_to']
         self.email_from = config_params['email_from']
+        self.alerts = EmailDispatcher(self.email_class, self.email_subject, self.email_to, self.email_from,
+                                      config_params['email_mode'])
+        self.service_interval = float(config_params['service_interval_minutes']) * 60
+        self.watermark_overlap = timedelta(minutes=float(config_params['service_watermark_overlap_minutes']))
+        self.recheck_seconds = float(config_params['service_recheck_minutes']) * 60
+        self.stopping = threading.Event()
+        # service mode state => the open tickets by key, the time of the last search and the last incomplete check
+        self.tracked = None
+        self.watermark = None
+        self.run_date = None
+        self.checked_at = {}
         self.tickets = []
         self.tickets_iter = []
         self.not_yet_list = []
+        self.gap_candidates = []
+        self.leased = set()
         self.logger = logging.getLogger(__name__)
+        # set the logging level of Qubole to "WARNING" to filter out 'info level' logging message deluge
+        logging.getLogger("qds_connection").setLevel(logging.WARNING)
 
     # Manages the overall automation
     #
     def process_manager(self):
+        # the jira writes run alongside the queries, starting with any left pending by an earlier run
+        self.write_back.start()
+        try:
+            self.query_process_manager()
+        finally:
+            self.release_leases()
+            # send the queued alert emails, as one digest unless per-ticket emails are configured
+            self.alerts.close()
+            # wait for the queued jira writes, those still failing are kept for the next run
+            with metrics.span('stage', stage='jira_write_back'):
+                self.write_back.close()
+
+    # Keeps the process resident, running a cycle every service interval until stopped, the clients, caches, write-back
+    # queue and tracked tickets are kept between cycles, after_cycle is called at the end of each cycle and on_exit once
+    # the service has stopped
+    #
+    def service_manager(self, after_cycle=None, on_exit=None):
+        self.tracked = {}
+        self.write_back.start()
+        try:
+            while not self.stopping.is_set():
+                # a new run date re-reads every open ticket, else only the tickets updated since the last search
+                if self.run_date != refresh_today_date():
+                    self.run_date = today_date
+                    self.logger.info("Run date is now {}, the next search is a full search".format(today_date))
+                    self.watermark = None
+                started = time.time()
+                # the writes that kept failing in an earlier cycle are sent again before their tickets are searched
+                self.write_back.requeue()
+                try:
+                    with metrics.span('stage', stage='service_cycle'):
+                        self.query_process_manager()
+                except Exception as e:
+                    self.logger.error("Service cycle failed => {}".format(e))
+                finally:
+                    self.release_leases()
+                    self.alerts.close()
+                if after_cycle is not None:
+                    after_cycle()
+                self.logger.info("Service cycle done, {} open ticket(s) tracked, next cycle in {} minute(s)\n"
+                                 .format(len(self.tracked), round(self.service_interval / 60, 1)))
+                self.stopping.wait(max(0, self.service_interval - (time.time() - started)))
+        finally:
+            if on_exit is not None:
+                on_exit()
+            with metrics.span('stage', stage='jira_write_back'):
+                self.write_back.close()
+
+    # Ends the service after the current cycle
+    #
+    def stop(self):
+        self.stopping.set()
+
+    # Releases the leases taken by this run that are still held, except those whose Jira write is pending
+    #
+    def release_leases(self):
+        leased, self.leased = self.leased, set()
+        for ticket_key in leased:
+            if not self.write_back.is_pending(ticket_key):
+                self.leases.release(ticket_key)
+
+    # Returns the tickets to process => the full Jira search, or in service mode the tracked open tickets after merging
+    # in those updated since the last search, a full search whenever there is no watermark
+    #
+    def search_tickets(self):
+        search = [self.jql_type, self.jql_status, self.jql_labels, self.jql_vertical, self.jql_media_partner,
+                  self.jql_data_source_hub, self.jql_text]
+        if self.tracked is None:
+            return self.jira_pars.iter_tickets(*search)
+
+        searched_at = time.time()
+        if self.watermark is None:
+            self.tracked = {}
+            self.checked_at = {}
+            updated_within = None
+        else:
+            # the minutes since the last search as measured on this host, the overlap covers the search's own duration
+            updated_within = int(math.ceil((searched_at - self.watermark + self.watermark_overlap.total_seconds())
+                                           / 60))
+        matched = set()
+        for ticket in self.jira_pars.iter_tickets(*search, updated_within=updated_within):
+            self.tracked[ticket.key] = ticket
+            # an updated ticket is checked again straight away
+            self.checked_at.pop(ticket.key, None)
+            matched.add(ticket.key)
+        # a tracked ticket updated out of the query criteria, moved on in status or labelled elsewhere, is dropped
+        left = 0
+        if updated_within is not None and len(self.tracked) > len(matched):
+            for ticket in self.jira_pars.iter_updated(updated_within):
+                if ticket.key in self.tracked and ticket.key not in matched:
+                    self.untrack(ticket.key)
+                    left += 1
+        self.watermark = searched_at
+        self.logger.info("{} search found {} ticket(s), {} left the criteria, {} open ticket(s) tracked"
+                         .format('Full' if updated_within is None else
+                                 'Incremental (last {} minutes)'.format(updated_within),
+                                 len(matched), left, len(self.tracked)))
+        return list(self.tracked.values())
+
+    # Drops a ticket from the tracked open tickets of service mode, it returns if a later search finds it updated
+    #
+    def untrack(self, ticket_key):
+        if self.tracked is not None:
+            self.tracked.pop(ticket_key, None)
+            self.checked_at.pop(ticket_key, None)
+
+    # Runs the ticket search, collection and queries
+    #
+    def query_process_manager(self):
+        self.tickets = []
+        self.tickets_iter = []
+        self.not_yet_list = []
+        self.deferred_list = []
+        self.gap_candidates = []
+        self.watermarks = None
+        self.prefilter_pending = set()
+        self.coalescer = None
+
+        # drops the ticket checks and provider lags older than the history retention period
+        if self.readiness is not None:
+            self.readiness.prune(today_date)
+
+        # per-ticket queries can be streamed, the consolidated query modes need every ticket collected first
+        if self.pipeline_enabled and self.query_mode == 'ticket':
+            with metrics.span('stage', stage='pipeline'):
+                self.pipeline_manager()
+            return
+
         try:
-            # Pulls desired tickets via jql
-            self.tickets = self.jira_pars.find_tickets(self.jql_type, self.jql_status, self.jql_labels, self.jql_vertical,
-                                                       self.jql_media_partner, self.jql_data_source_hub, self.jql_text)
+            # Pulls desired tickets via jql, each page fetched is timed by the Jira manager
+            self.tickets = list(self.search_tickets())
         except Exception as e:
             self.logger.error("Jira ticket search failed => {}".format(e))
         else:
             # check for an empty ticket list, if not empty, process the list
-            if self.tickets is not None:
+            if self.tickets:
                 self.logger.info("{} ticket(s) were found that match the criteria.\n".format(len(self.tickets)))
 
                 # mines the ticket for data, calls apis and creates iterable for concurrency to populate queries
-                self.input_collection_manager()
+                with metrics.span('stage', stage='input_collection'):
+                    self.input_collection_manager()
+
+                # brings the summary table up to date, adding the providers of these tickets
+                if self.summary_registry is not None and self.tickets_iter:
+                    provider_starts = {}
+                    for ticket_iter in self.tickets_iter:
+                        provider_starts[ticket_iter[1]] = min(ticket_iter[3], provider_starts.get(ticket_iter[1],
+                                                                                                  ticket_iter[3]))
+                    with metrics.span('stage', stage='summary'):
+                        self.summary_manager(provider_starts)
 
-                # launch the queries concurrently on Qubole
-                self.retail_concurrency_manager(self.tickets_iter)
+                # drops the tickets whose provider's data has not been loaded through the post-period end date
+                if self.prefilter_enabled and self.tickets_iter:
+                    with metrics.span('stage', stage='prefilter'):
+                        self.watermarks = WatermarkIndex(min(ticket_iter[6] for ticket_iter in self.tickets_iter))
+                        self.watermark_manager([ticket_iter[1] for ticket_iter in self.tickets_iter])
+                        self.tickets_iter = [ticket_iter for ticket_iter in self.tickets_iter
+                                             if self.prefilter(ticket_iter)]
+
+                # launch the queries on Qubole: one consolidated query, one incremental store query or one per ticket
+                with metrics.span('stage', stage='queries'):
+                    if self.query_mode == 'batch':
+                        self.batch_query_manager(self.tickets_iter)
+                    elif self.query_mode == 'store':
+                        self.store_query_manager(self.tickets_iter)
+                    else:
+                        self.retail_concurrency_manager(self.tickets_iter)
             else:
                 # writes log error and exits program
                 self.logger.info("\n\nThere were no tickets to process today.\n")
@@ -68,75 +353,290 @@ class DataCrawlerManager(object):
     # Validates ticket for processing, collects and organizes data to run queries, sends alert if no pid
     #
     def input_collection_manager(self):
-        # iterates through list of found tickets
-        for ticket in self.tickets:
-
-            # fetches the relevant ticket information for the api calls and qubole query
-            study_number, pp_end_date_adj, start_date, lead_analyst, pp_end_date = \
-                self.jira_pars.ticket_information_pull(ticket)
-
-            # check for past post-period end date, if true process to find pid, else log alert and do nothing else
-            if pp_end_date < today_date:
-                pid = self.api_manager(study_number)
-
-                # create the iterable required for the concurrency processing, excluding those without a pid
-                if pid is not None:
-                    self.tickets_iter.append([ticket.key, pid, pp_end_date_adj, start_date, study_number,
-                                              lead_analyst, pp_end_date])
-                    self.logger.info("Ticket {} will have a Qubole query run, see the concurrent processing "
-                                     "section below.".format(ticket.key))
-                else:
-                    # writes missing pid alert to log file
-                    self.logger.warning("Ticket Number: {} has no Provider id, Qubole/Hive query will NOT be run."
-                                        .format(ticket))
-                    self.logger.info("Ticket data -> Study no.: {}\tPost-period end date (plus 1 day): {}"
-                                     "\tStart Date (minus 1 yr): {}\tProvider id: {}"
-                                     .format(study_number, pp_end_date_adj, start_date, pid))
-
-                    # send an alert email to notify that a ticket has no associated provider id
-                    self.emailer(ticket, study_number, start_date, pp_end_date_adj)
-            else:
-                self.not_yet_list.append(ticket)
+        # fetches the relevant ticket information, keeping the tickets whose post-period end date has passed
+        due_tickets = [due_ticket for due_ticket in map(self.collect_ticket, self.tickets) if due_ticket is not None]
+
+        # resolves the provider ids concurrently, results are returned in ticket order
+        pids = self.api_concurrency_manager([due_ticket[1] for due_ticket in due_tickets])
+
+        for due_ticket, (pid, resolved) in zip(due_tickets, pids):
+            # create the iterable required for the concurrency processing, excluding those without a pid
+            ticket_iter = self.qualify_ticket(due_ticket, pid, resolved)
+            if ticket_iter is not None and self.defer(ticket_iter):
+                self.tickets_iter.append(ticket_iter)
+
+        self.log_collection_summary()
+
+    # Fetches the relevant ticket information for the api calls and qubole query, returns None for tickets whose
+    # post-period end date has not yet passed
+    #
+    def collect_ticket(self, ticket):
+        # a ticket whose results are still waiting to be written to jira is already complete
+        if self.write_back.is_pending(ticket.key):
+            self.logger.info("Ticket {} has a pending Jira write, it will not be queried again".format(ticket.key))
+            return None
+        # in service mode a ticket found incomplete is not queried again until its recheck interval has passed
+        if time.time() - self.checked_at.get(ticket.key, 0) < self.recheck_seconds:
+            return None
+
+        study_number, pp_end_date_adj, start_date, lead_analyst, pp_end_date = \
+            self.jira_pars.ticket_information_pull(ticket)
+
+        # check for past post-period end date, if true queue to find pid, else log alert and do nothing else, a due
+        # ticket is only taken once its lease is held when several nodes share the work
+        if pp_end_date < today_date:
+            if self.leases is not None:
+                if not self.leases.acquire(ticket.key):
+                    return None
+                self.leased.add(ticket.key)
+            return ticket, study_number, pp_end_date_adj, start_date, lead_analyst, pp_end_date
+        self.not_yet_list.append(ticket)
+        return None
+
+    # Returns the iterable entry for a ticket with a resolved provider id, else logs and alerts the missing pid
+    #
+    def qualify_ticket(self, due_ticket, pid, resolved):
+        ticket, study_number, pp_end_date_adj, start_date, lead_analyst, pp_end_date = due_ticket
+        if pid is not None:
+            self.logger.info("Ticket {} will have a Qubole query run, see the concurrent processing "
+                             "section below.".format(ticket.key))
+            return [ticket.key, pid, pp_end_date_adj, start_date, study_number, lead_analyst, pp_end_date, ticket]
+
+        # writes missing pid alert to log file
+        self.logger.warning("Ticket Number: {} has no Provider id, Qubole/Hive query will NOT be run."
+                            .format(ticket))
+        self.logger.info("Ticket data -> Study no.: {}\tPost-period end date (plus 1 day): {}"
+                         "\tStart Date (minus 1 yr): {}\tProvider id: {}"
+                         .format(study_number, pp_end_date_adj, start_date, pid))
 
+        # send an alert email to notify that a ticket has no associated provider id, unless the api failed
+        if resolved:
+            self.emailer(ticket, study_number, start_date, pp_end_date_adj)
+            # alert once, the ticket is looked at again by the service only once it is updated
+            self.untrack(ticket.key)
+        else:
+            self.logger.error("Provider id lookup for ticket {} failed on the api, no alert sent, it will be "
+                              "retried on the next run".format(ticket.key))
+        if self.leases is not None:
+            self.leases.release(ticket.key)
+        return None
+
+    # Writes the last use times of the api cache hits, logs the cache use and the tickets that have not yet reached their
+    # post-period end date
+    #
+    def log_collection_summary(self):
+        self.api_cache.flush()
         self.logger.info("")
+        self.logger.info("Api lookup cache: {} hit(s), {} miss(es)".format(self.api_cache.hits, self.api_cache.misses))
         # log a list of any tickets that have not yet reached their pp date which is required
         self.logger.info("{} tickets that have not yet passed their Post-processing date: {}"
                          .format(len(self.not_yet_list), [ticket.key for ticket in self.not_yet_list]))
+        if self.readiness is not None:
+            self.logger.info("{} tickets deferred until their provider's expected ready date: {}"
+                             .format(len(self.deferred_list), self.deferred_list))
+
+    # Streams tickets from the Jira search through ticket mining and provider id resolution straight into the query
+    # scheduler, so each ticket's query is launched as soon as its provider id is known
+    #
+    def pipeline_manager(self):
+        self.logger.info("Beginning the streaming processing of the ticket search.")
+        self.logger.info("\n")
+
+        # set the logging level of urllib3 to "ERROR" to filter out 'warning level' logging message deluge
+        logging.getLogger("urllib3").setLevel(logging.ERROR)
+
+        scheduler = QueryScheduler(self.query_manager, self.cluster_labels, self.max_in_flight,
+                                   self.min_in_flight, self.target_queue_seconds)
+        scheduler.start()
+
+        # tickets of the same provider share one scan, a late ticket waits on the scan already running
+        if self.coalesce_enabled:
+            self.coalescer = QueryCoalescer()
+
+        # the provider ids are not known up front, so the watermarks of every provider loaded within the lookback
+        # period are fetched alongside the Jira search
+        if self.prefilter_enabled:
+            self.watermarks = WatermarkIndex((datetime.strptime(today_date, '%Y-%m-%d') -
+                                              timedelta(days=self.prefilter_lookback_days)).strftime('%Y-%m-%d'))
+            threading.Thread(target=self.watermark_manager, name="Watermarks", daemon=True).start()
+
+        # the provider ids are not known up front either, so the summary is brought up to date for the providers of
+        # earlier runs alongside the search, the queries read the transaction table until it is
+        summary_thread = None
+        if self.summary_registry is not None:
+            summary_thread = threading.Thread(target=self.summary_manager, name="Summary", daemon=True)
+            summary_thread.start()
+
+        # hands each resolved ticket straight to the scheduler, unless the watermarks show its data is not loaded yet,
+        # a ticket resolved while the watermarks are still loading is not held for them but checked at query time
+        def resolve_stage(due_ticket):
+            with ticket_scope(due_ticket[0].key):
+                pid, resolved = self.api_manager(due_ticket[1])
+                ticket_iter = self.qualify_ticket(due_ticket, pid, resolved)
+                if ticket_iter is not None and self.defer(ticket_iter) and self.prefilter(ticket_iter, wait=False):
+                    self.tickets_iter.append(ticket_iter)
+                    scheduler.submit(ticket_iter, self.overdue_days(ticket_iter))
+
+        def collect_stage(ticket):
+            self.tickets.append(ticket)
+            with ticket_scope(ticket.key):
+                return self.collect_ticket(ticket)
+
+        self.tickets = []
+        pipeline = PipelineManager()
+        pipeline.add_stage("Collect", collect_stage, self.collect_workers, self.stage_queue_size)
+        pipeline.add_stage("Resolve", resolve_stage, self.api_workers, self.stage_queue_size)
+        try:
+            pipeline.run(self.search_tickets())
+        finally:
+            scheduler.join()
+            # a long first append must not be cut off by the process exiting before its providers are marked covered
+            if summary_thread is not None:
+                summary_thread.join()
+
+        # check the per-day coverage of the tickets that reached their post-period end date
+        self.gap_manager()
+
+        if not self.tickets:
+            self.logger.info("\n\nThere were no tickets to process today.\n")
+            return
+
+        self.logger.info("{} ticket(s) were found that match the criteria.\n".format(len(self.tickets)))
+        self.log_collection_summary()
+        self.logger.info("")
+        self.logger.info("Concluded the streaming processing of {} ticket(s)".format(len(self.tickets_iter)))
+
+    # Runs the one lightweight watermark query of the run, the latest loaded transaction date of each provider since
+    # the run's watermark floor date, for the given provider ids or for every provider when none are given
+    #
+    def watermark_manager(self, provider_ids=None):
+        floor_date = self.watermarks.floor_date
+        try:
+            qubole = self.query_command(("watermark", "since {}".format(floor_date)),
+                                        lambda query: query.watermark_query(floor_date, provider_ids),
+                                        None if provider_ids is None else {pid: floor_date for pid in provider_ids})
+            with metrics.span('hive_query', kind='watermark'):
+                result_rows = qubole.get_result_rows()
+                if result_rows is not None:
+                    self.watermarks.load(result_rows)
+        except Exception as e:
+            self.logger.error("Watermark query failed => {}".format(e))
+        finally:
+            # release the tickets waiting on the watermarks whatever the outcome
+            if self.watermarks.watermarks is None:
+                self.logger.error("Watermark query returned no results, no tickets will be prefiltered")
+                self.watermarks.fail()
+            else:
+                self.logger.info("Watermarks loaded for {} provider(s) since {}"
+                                 .format(len(self.watermarks.watermarks), floor_date))
 
-    # Manages the api class instance creation and function calls
+    # Returns False for a ticket that is not due a check before its provider's expected ready date, releasing its
+    # lease, True for the tickets that go on to the prefilter and their queries
+    #
+    def defer(self, ticket_iter):
+        if self.readiness is None:
+            return True
+        due, ready_date = self.readiness.due(ticket_iter[0], ticket_iter[1], ticket_iter[6], today_date)
+        metrics.increment('readiness_outcomes', outcome='due' if due else 'deferred')
+        if not due:
+            self.logger.info("Ticket {} deferred, provider {} data is not expected to be complete before {}"
+                             .format(ticket_iter[0], ticket_iter[1], ready_date))
+            self.deferred_list.append(ticket_iter[0])
+            if self.leases is not None:
+                self.leases.release(ticket_iter[0])
+        return due
+
+    # Returns False for a ticket whose provider's watermark is before its post-period end date, logging it as
+    # incomplete, True for the tickets that go on to their queries, including those let through unchecked while the
+    # watermarks are still loading when wait is False
+    #
+    def prefilter(self, ticket_iter, wait=True):
+        if self.watermarks is None:
+            return True
+        ready = self.watermarks.ready(ticket_iter[1], ticket_iter[6], wait)
+        if ready is None and not self.watermarks.loaded.is_set():
+            metrics.increment('prefilter_outcomes', outcome='pending')
+            self.prefilter_pending.add(ticket_iter[0])
+            return True
+        self.prefilter_pending.discard(ticket_iter[0])
+        metrics.increment('prefilter_outcomes', outcome={True: 'pass', False: 'drop', None: 'unknown'}[ready])
+        if ready is False:
+            self.log_ticket_parameters(ticket_iter)
+            self.logger.info("Provider {} has no data loaded through the post-period end date {}, no query will be run"
+                             .format(ticket_iter[1], ticket_iter[6]))
+            self.ticket_manager(ticket_iter, None)
+            return False
+        return True
+
+    # Resolves the provider ids for a list of study numbers with a bounded number of concurrent api calls
+    #
+    def api_concurrency_manager(self, study_numbers):
+        if not study_numbers:
+            return []
+
+        from multiprocessing.dummy import Pool as ThreadPool
+
+        with ThreadPool(processes=min(self.api_workers, len(study_numbers))) as api_pool:
+            try:
+                return api_pool.map(self.api_manager, study_numbers)
+            except Exception as e:
+                self.logger.error("Concurrent provider id resolution failed => {}".format(e))
+                return [(None, False)] * len(study_numbers)
+
+    # Manages the api call function calls through the shared session and the lookup cache, returns a tuple of
+    # (provider id, resolved) where resolved is False when the api failed rather than the provider id being missing
     #
     def api_manager(self, id_num):
-        # create api search object instance
-        api_manager = APICallManager()
+        # api search object instance, shares the keep-alive session pool across all threads
+        api_manager = self.api_client()
 
-        # api call to find study data
-        study_call_results = api_manager.api_call(self.study_url, id_num)
+        # check the cache, else api call to find study data
+        found, parent_company_id = self.api_cache.get('study', id_num)
+        metrics.increment('api_cache_lookups', result='hit' if found else 'miss')
+        if not found:
+            with metrics.span('api_call', endpoint='study'):
+                study_call_results = api_manager.api_call(self.study_url, id_num)
 
-        # confirm api call returned results, search to find required data
-        if study_call_results is not None:
-            parent_company_id = api_manager.parent_id_fetch(study_call_results)
-        else:
-            return None
+            # confirm api call returned results, search to find required data
+            if study_call_results is not None:
+                parent_company_id = api_manager.parent_id_fetch(study_call_results)
+                self.api_cache.put('study', id_num, parent_company_id)
+            else:
+                return None, False
 
-        # api call to find parent company data
-        provider_call_results = api_manager.api_call(self.account_url, parent_company_id)
+        if parent_company_id is None:
+            return None, True
 
-        # confirm api call returned results, search to find required data
-        if provider_call_results is not None:
-            provider_id = api_manager.provider_id_fetch(provider_call_results)
-            return provider_id
-        else:
-            return None
+        # check the cache, else api call to find parent company data
+        found, provider_id = self.api_cache.get('parent', parent_company_id)
+        metrics.increment('api_cache_lookups', result='hit' if found else 'miss')
+        if not found:
+            with metrics.span('api_call', endpoint='account'):
+                provider_call_results = api_manager.api_call(self.account_url, parent_company_id)
 
-    # Creates the Email Manager instance, launches the emailer module
+            # confirm api call returned results, search to find required data
+            if provider_call_results is not None:
+                provider_id = api_manager.provider_id_fetch(provider_call_results)
+                self.api_cache.put('parent', parent_company_id, provider_id)
+            else:
+                return None, False
+
+        return provider_id, True
+
+    # Returns the shared api caller, creating its keep-alive session on first use, a run without due tickets never
+    # needs it
     #
-    def emailer(self, ticket, study_number, start_date, pp_end_date_adj):
-        # create emailer object instance
-        retail_email = EmailManager(ticket, study_number, start_date, pp_end_date_adj, self.email_subject,
-                                    self.email_to, self.email_from)
+    def api_client(self):
+        return self.resources.get(('api', self.api_workers, self.api_retries, self.api_backoff, self.api_timeout),
+                                  lambda: self.api_class(self.api_class.create_session(self.api_workers,
+                                                                                       self.api_retries,
+                                                                                       self.api_backoff),
+                                                         self.api_timeout))
 
-        # launch the emailer
-        retail_email.retail_emailer()
+    # Queues the missing provider id alert with the email dispatcher, sent off the processing path
+    #
+    def emailer(self, ticket, study_number, start_date, pp_end_date_adj):
+        self.alerts.add(ticket, study_number, start_date, pp_end_date_adj)
 
     # Run the qubole/hive query for each of the tickets that qualify
     #
@@ -145,71 +645,455 @@ class DataCrawlerManager(object):
         self.logger.info("Beginning the concurrent processing of {} ticket(s).".format(len(tickets_iter)))
         self.logger.info("\n")
 
-        # activate concurrency logging handler
-        install_mp_handler(logger=self.logger)
         # set the logging level of urllib3 to "ERROR" to filter out 'warning level' logging message deluge
         logging.getLogger("urllib3").setLevel(logging.ERROR)
 
-        # launches a thread for each of the tickets
-        with ThreadPool(processes=len(tickets_iter)) as pixel_pool:
-            try:
-                pixel_pool.map(self.query_manager, tickets_iter)
-                pixel_pool.close()
-                pixel_pool.join()
-            except Exception as e:
-                self.logger.error("Concurrency run failed => {}".format(e))
-            else:
-                self.logger.info("")
-                self.logger.info("Concluded the concurrent processing")
+        # tickets of the same provider share one scan starting at the earliest of their windows
+        if self.coalesce_enabled:
+            self.coalescer = QueryCoalescer()
+            for ticket_iter in tickets_iter:
+                self.coalescer.plan(ticket_iter[1], ticket_iter[3])
+
+        # launches the queries through the bounded scheduler, the most overdue tickets first
+        scheduler = QueryScheduler(self.query_manager, self.cluster_labels, self.max_in_flight,
+                                   self.min_in_flight, self.target_queue_seconds)
+        try:
+            scheduler.run(tickets_iter, priority=self.overdue_days)
+        except Exception as e:
+            self.logger.error("Concurrency run failed => {}".format(e))
+        else:
+            self.logger.info("")
+            self.logger.info("Concluded the concurrent processing")
+
+        # check the per-day coverage of the tickets that reached their post-period end date
+        self.gap_manager()
+
+    # Returns the number of days a ticket's post-period end date is overdue, used as the scheduling priority
+    #
+    @staticmethod
+    def overdue_days(ticket_iter):
+        return (datetime.strptime(today_date, '%Y-%m-%d') - datetime.strptime(ticket_iter[6], '%Y-%m-%d')).days
 
     # Manages the qubole queries, returns and logs results
     #
-    def query_manager(self, ticket_iter):
+    @ticket_logged
+    def query_manager(self, ticket_iter, cluster_label=None):
         # checks that the required ticket information exists, else bypasses Qubole
         if ticket_iter:
-            # set the logging level of Qubole to "WARNING" to filter out 'info level' logging message deluge
-            logging.getLogger("qds_connection").setLevel(logging.WARNING)
+            if self.journal is not None:
+                self.journal.record_ticket(ticket_iter[0], 'querying')
+
+            # a ticket let through while the watermarks were loading is prefiltered once they are in
+            if ticket_iter[0] in self.prefilter_pending and not self.prefilter(ticket_iter, wait=False):
+                return None
+
+            # probe for any data on or after the post-period end date before paying for the full coverage query, unless
+            # the watermarks already showed the data is there or a scan covering the window is already under way
+            if self.probe_enabled and not (self.watermarks is not None and
+                                           self.watermarks.ready(ticket_iter[1], ticket_iter[6], wait=False)) and \
+                    not (self.coalescer is not None and self.coalescer.covers(ticket_iter[1], ticket_iter[3])):
+                probe = self.query_command((ticket_iter[0], "probe"),
+                                           lambda query: query.probe_query(ticket_iter[1], ticket_iter[6], today_date),
+                                           {ticket_iter[1]: ticket_iter[6]}, cluster_label)
+                with metrics.span('hive_query', kind='probe'):
+                    probe_results = probe.get_results()
+                metrics.increment('probe_outcomes', outcome='pass' if probe_results else 'fail')
+                if not probe_results:
+                    self.log_ticket_parameters(ticket_iter)
+                    self.logger.info("Probe found no data on or after the post-period end date {}"
+                                     .format(ticket_iter[6]))
+                    self.ticket_manager(ticket_iter, None)
+                    return probe.queue_seconds
 
-            # create an instance of query object
-            query = ProviderTransaction()
+            if self.coalescer is not None:
+                # share one scan of the provider's dates with every ticket whose window it covers
+                return self.coalesced_query(ticket_iter, cluster_label)
 
-            # create an instance of qubole object
-            qubole = QuboleManager((ticket_iter[0], "".join(str(ticket_iter[1]))), self.qubole_token,
-                                   self.cluster_label, query.max_transact_date_query(ticket_iter[1],
-                                   ticket_iter[2], ticket_iter[3]))
+            # create an instance of the query command on the engine that fits it
+            qubole = self.query_command((ticket_iter[0], "".join(str(ticket_iter[1]))),
+                                        lambda query: query.max_transact_date_query(ticket_iter[1], ticket_iter[2],
+                                                                                    ticket_iter[3]),
+                                        {ticket_iter[1]: ticket_iter[3]}, cluster_label)
             # launch query and return results
-            query_results = qubole.get_results()
+            with metrics.span('hive_query', kind='ticket'):
+                query_results = qubole.get_results()
+            self.query_results_manager(ticket_iter, query_results)
+
+            # return the observed cluster queue time to the scheduler
+            return qubole.queue_seconds
+
+    # Logs the study parameters of a queried ticket and posts it when its results reach the post-period end date
+    #
+    @ticket_logged
+    def query_results_manager(self, ticket_iter, query_results):
+        # log the study parameters
+        self.log_ticket_parameters(ticket_iter)
+
+        # check that all the study data is available by verifying the max-data-date at least equals the pp-end-date
+        if query_results and query_results[3] >= ticket_iter[6]:
+            # call function to check the per-day coverage or post results to and progress ticket
+            self.complete_manager(ticket_iter, query_results)
+        else:
+            # call function to log no results and end of thread
+            self.ticket_manager(ticket_iter, None)
+
+    # Answers a ticket's coverage from the shared scan of its provider, returns the cluster queue seconds of the scan
+    # the ticket ran, None when it joined another ticket's scan, whose thread then answers it once the scan is done so
+    # that the joining ticket frees its query slot straight away
+    #
+    def coalesced_query(self, ticket_iter, cluster_label=None):
+        scan = {}
+
+        def fetch(scan_start):
+            scan['qubole'] = self.query_command(("coverage", str(ticket_iter[1])),
+                                                lambda query: query.provider_dates_query({ticket_iter[1]: scan_start}),
+                                                {ticket_iter[1]: scan_start}, cluster_label)
+            with metrics.span('hive_query', kind='coalesced'):
+                result_rows = scan['qubole'].get_result_rows()
+                return None if result_rows is None else [row[1] for row in result_rows]
+
+        def answer(dates):
+            self.query_results_manager(ticket_iter, None if dates is None else
+                                       QueryCoalescer.coverage(dates, ticket_iter[2], ticket_iter[3]))
+
+        self.coalescer.scan(ticket_iter[1], ticket_iter[3], fetch, answer)
+        return scan['qubole'].queue_seconds if 'qubole' in scan else None
+
+    # Returns the engine a query runs on => the interactive engine when its estimated scan, the days from each
+    # provider's start date to the run date summed over its providers, is within the interactive limit, else the default
+    # engine, queries over every provider count as over the limit
+    # provider_starts: dict of {provider_id: date from which the provider is read}, None for every provider
+    #
+    def query_engine(self, provider_starts):
+        if not self.interactive_engine or self.query_engine_name == 'local' or provider_starts is None:
+            return self.query_engine_name
+        run_day = datetime.strptime(today_date, '%Y-%m-%d')
+        provider_days = sum(max((run_day - datetime.strptime(start_date[:10], '%Y-%m-%d')).days + 1, 1)
+                            for start_date in provider_starts.values())
+        if provider_days <= self.interactive_max_provider_days:
+            return self.interactive_engine
+        return self.query_engine_name
+
+    # Builds a query in the dialect of the engine chosen for its estimated size, reading the summary table when it
+    # covers every provider of the query, and returns the command that runs it
+    # provider_starts: dict of {provider_id: date from which the provider is read}, None for every provider
+    #
+    def query_command(self, name, build, provider_starts, cluster_label=None):
+        engine = self.query_engine(provider_starts)
+        metrics.increment('query_engine', engine=engine)
+        query = build(ProviderTransaction(engine, self.summary_source(provider_starts)))
+        return self.engine_command(name, engine, query, cluster_label)
+
+    # Returns the command running a query on the engine, the interactive engines run on their own cluster, hive on the
+    # scheduler's cluster
+    #
+    def engine_command(self, name, engine, query, cluster_label=None):
+        if engine == 'local':
+            return LocalSqlEngine(name, self.local_db_path, query)
+        if engine != 'hive':
+            cluster_label = self.interactive_cluster_label
+        return self.qubole_class(name, self.qubole_token, cluster_label or self.cluster_labels[0], query, self.poller,
+                                 self.journal, engine)
+
+    # Returns the summary table when it has been maintained and covers every provider of a query from its start date,
+    # else None for the raw transaction table, recording the providers it is missing for the next maintenance
+    #
+    def summary_source(self, provider_starts):
+        if self.summary_registry is None or provider_starts is None:
+            return None
+        covered = self.summary_covered
+        missing = {pid: start_date for pid, start_date in provider_starts.items()
+                   if covered is None or covered.get(str(pid)) is None or start_date < covered[str(pid)]}
+        for pid, start_date in provider_starts.items():
+            self.summary_registry.request(pid, start_date, today_date)
+        metrics.increment('summary_reads', source='raw' if missing else 'summary')
+        return None if missing else self.summary_table
+
+    # Maintains the summary table => adds the providers requested since the last maintenance from their requested start
+    # date and appends each covered provider's dates missing from the rescan window before its latest summarized date,
+    # so that a daily run reads only the newest partitions, then lets the queries of the covered providers read the
+    # summary
+    # provider_starts: dict of {provider_id: date from which the provider is needed} known before the queries are run
+    #
+    def summary_manager(self, provider_starts=None):
+        for pid, start_date in (provider_starts or {}).items():
+            self.summary_registry.request(pid, start_date, today_date)
+        pruned = self.summary_registry.prune(today_date)
+        pending = self.summary_registry.pending()
+        if self.summary_covered is not None and not pending and \
+                time.time() - self.summary_refreshed < self.summary_refresh_seconds:
+            return
+        covered = self.summary_registry.covered()
+        query = ProviderTransaction(self.query_engine_name)
+
+        if not self.summary_created:
+            create = self.engine_command(("summary", "create"), self.query_engine_name,
+                                         query.summary_create_query(self.summary_table))
+            if not create.execute():
+                self.logger.error("Summary table {} could not be created, queries read the transaction table"
+                                  .format(self.summary_table))
+                self.summary_covered = None
+                return
+            self.summary_created = True
+
+        # each covered provider is scanned again from the rescan window before its latest summarized date, whose day
+        # may have been partial and whose earlier days may have been loaded late
+        scan_starts = dict(covered)
+        if covered:
+            high_water = self.engine_command(("summary", "high water"), self.query_engine_name,
+                                             query.summary_high_water_query(self.summary_table, covered))
+            with metrics.span('hive_query', kind='summary_high_water'):
+                result_rows = high_water.get_result_rows()
+            if result_rows is None:
+                self.logger.error("Summary high-water query returned no results, queries read the transaction table")
+                self.summary_covered = None
+                return
+            for pid, high_water in result_rows:
+                if high_water is not None:
+                    rescan_from = (datetime.strptime(str(high_water)[:10], '%Y-%m-%d') -
+                                   timedelta(days=self.summary_rescan_days)).strftime('%Y-%m-%d')
+                    scan_starts[str(pid)] = max(covered.get(str(pid), rescan_from), rescan_from)
+        for pid, start_date in pending.items():
+            scan_starts[pid] = min(start_date, scan_starts.get(pid, start_date))
+
+        if scan_starts:
+            append = self.engine_command(("summary", "{} providers".format(len(scan_starts))), self.query_engine_name,
+                                         query.summary_insert_query(self.summary_table, scan_starts))
+            with metrics.span('hive_query', kind='summary_append'):
+                appended = append.execute()
+            if not appended:
+                self.logger.error("Summary append failed, queries read the transaction table")
+                self.summary_covered = None
+                return
+        self.summary_registry.mark_covered(pending)
+        self.summary_covered = self.summary_registry.covered()
+        self.summary_refreshed = time.time()
+        self.logger.info("Summary table {} maintained for {} provider(s), {} added, {} dropped"
+                         .format(self.summary_table, len(self.summary_covered), len(pending), pruned))
+
+    # Logs the study parameters of a ticket
+    #
+    @ticket_logged
+    def log_ticket_parameters(self, ticket_iter):
+        self.logger.info("Ticket Number: {}".format(ticket_iter[0]))
+        self.logger.info("Study no.: {}\tPost-period end date (plus 1 day): {}\tStart Date (minus 1 yr): {}"
+                         "\tProvider id: {}".format(ticket_iter[4], ticket_iter[2], ticket_iter[3], ticket_iter[1]))
+
+    # Runs one consolidated qubole query covering every qualifying ticket, fans the results back out per ticket
+    #
+    def batch_query_manager(self, tickets_iter):
+        self.logger.info("")
+        self.logger.info("Beginning the batched processing of {} ticket(s).".format(len(tickets_iter)))
+        self.logger.info("\n")
+
+        if not tickets_iter:
+            return
+
+        # one window per ticket => [ticket key, pid, pp_end_date_adj, start_date]
+        windows = [[ticket_iter[0], ticket_iter[1], ticket_iter[2], ticket_iter[3]] for ticket_iter in tickets_iter]
+        provider_starts = {}
+        for window in windows:
+            provider_starts[window[1]] = min(window[3], provider_starts.get(window[1], window[3]))
+
+        # create an instance of the query command and launch the single query
+        qubole = self.query_command(("batch", "{} tickets".format(len(tickets_iter))),
+                                    lambda query: query.batch_coverage_query(windows), provider_starts)
+        with metrics.span('hive_query', kind='batch'):
+            result_rows = qubole.get_result_rows()
+        if result_rows is None:
+            self.logger.error("Batched query returned no results, no tickets will be updated")
+            return
+
+        # index the returned rows by ticket key, the first column of each row
+        self.results_manager(tickets_iter, {row[0]: list(row[1:]) for row in result_rows})
+
+        self.logger.info("")
+        self.logger.info("Concluded the batched processing")
+
+    # Runs one incremental qubole query per run covering only the dates from the rescan window before each provider's
+    # stored high-water mark, merges them into the coverage store and answers every ticket's coverage from the store
+    #
+    def store_query_manager(self, tickets_iter):
+        self.logger.info("")
+        self.logger.info("Beginning the incremental coverage processing of {} ticket(s).".format(len(tickets_iter)))
+        self.logger.info("\n")
+
+        if not tickets_iter:
+            return
+
+        store = CoverageStore(self.coverage_store_path, self.coverage_rescan_days)
+        try:
+            # find the earliest date each provider still needs scanning from across all of its tickets
+            provider_starts = {}
+            for ticket_iter in tickets_iter:
+                scan_start = store.scan_start(ticket_iter[1], ticket_iter[3])
+                provider_starts[ticket_iter[1]] = min(scan_start, provider_starts.get(ticket_iter[1], scan_start))
+            self.logger.info("Provider scan start dates: {}".format(provider_starts))
+
+            # create an instance of the query command, launch the single incremental query
+            qubole = self.query_command(("coverage", "{} providers".format(len(provider_starts))),
+                                        lambda query: query.provider_dates_query(provider_starts), provider_starts)
+            with metrics.span('hive_query', kind='store'):
+                result_rows = qubole.get_result_rows()
+            if result_rows is None:
+                self.logger.error("Incremental coverage query returned no results, no tickets will be updated")
+                return
+
+            # group the returned (provider id, txn date) rows and merge them into the store
+            provider_dates = {str(pid): [] for pid in provider_starts}
+            for row in result_rows:
+                provider_dates.setdefault(str(row[0]), []).append(row[1])
+            for pid, scan_start in provider_starts.items():
+                store.merge(pid, scan_start, provider_dates[str(pid)])
+
+            # answer each ticket's day count, min and max dates from the store
+            self.results_manager(tickets_iter, {ticket_iter[0]: store.coverage(ticket_iter[1], ticket_iter[2],
+                                                                               ticket_iter[3])
+                                                for ticket_iter in tickets_iter}, store)
+        finally:
+            store.close()
+
+        self.logger.info("")
+        self.logger.info("Concluded the incremental coverage processing")
+
+    # Fans query results out to each ticket, logging the study parameters and posting the completed ones
+    #
+    def results_manager(self, tickets_iter, results_by_ticket, store=None):
+        for ticket_iter in tickets_iter:
+            query_results = results_by_ticket.get(ticket_iter[0])
 
             # log the study parameters
-            self.logger.info("Ticket Number: {}".format(ticket_iter[0]))
-            self.logger.info("Study no.: {}\tPost-period end date (plus 1 day): {}\tStart Date (minus 1 yr): {}"
-                             "\tProvider id: {}".format(ticket_iter[4], ticket_iter[2], ticket_iter[3], ticket_iter[1]))
+            self.log_ticket_parameters(ticket_iter)
 
             # check that all the study data is available by verifying the max-data-date at least equals the pp-end-date
             if query_results and query_results[3] >= ticket_iter[6]:
-                # call function to post results to and progress ticket
-                self.ticket_manager(ticket_iter, query_results)
+                self.complete_manager(ticket_iter, query_results)
             else:
-                # call function to log no results and end of thread
                 self.ticket_manager(ticket_iter, None)
 
+        # check the per-day coverage of the tickets that reached their post-period end date
+        self.gap_manager(store)
+
+    # Holds a ticket that reached its post-period end date for the per-day coverage check, else posts it directly
+    #
+    @ticket_logged
+    def complete_manager(self, ticket_iter, results):
+        if self.gap_check:
+            self.gap_candidates.append((ticket_iter, results))
+        else:
+            self.ticket_manager(ticket_iter, results)
+
+    # Finds the missing date ranges of every held ticket's window at once, posts the tickets within the allowed
+    # number of missing days, the per-day dates come from the coverage store or from one qubole query
+    #
+    def gap_manager(self, store=None):
+        candidates, self.gap_candidates = self.gap_candidates, []
+        if not candidates:
+            return
+        metrics.increment('gap_checked_tickets', len(candidates))
+
+        self.logger.info("")
+        self.logger.info("Checking the per-day coverage of {} ticket(s).".format(len(candidates)))
+
+        # collect the transaction dates of each provider from the earliest window start among its tickets
+        provider_starts = {}
+        for ticket_iter, results in candidates:
+            provider_starts[ticket_iter[1]] = min(ticket_iter[3], provider_starts.get(ticket_iter[1], ticket_iter[3]))
+        if store is not None:
+            provider_dates = {str(pid): store.dates(pid, start_date) for pid, start_date in provider_starts.items()}
+        else:
+            # the dates of providers already scanned this run are reused, only the other providers are queried
+            provider_dates = {}
+            if self.coalescer is not None:
+                for pid, start_date in provider_starts.items():
+                    dates = self.coalescer.cached(pid, start_date)
+                    if dates is not None:
+                        provider_dates[str(pid)] = dates
+            unscanned = {pid: start_date for pid, start_date in provider_starts.items()
+                         if str(pid) not in provider_dates}
+            if unscanned:
+                qubole = self.query_command(("coverage", "{} providers".format(len(unscanned))),
+                                            lambda query: query.provider_dates_query(unscanned), unscanned)
+                with metrics.span('hive_query', kind='per_day'):
+                    result_rows = qubole.get_result_rows()
+                if result_rows is None:
+                    self.logger.error("Per-day coverage query returned no results, held tickets will not be updated")
+                    return
+                provider_dates.update({str(pid): [] for pid in unscanned})
+                for row in result_rows:
+                    provider_dates.setdefault(str(row[0]), []).append(row[1])
+
+        # numpy is only loaded once there are windows to check
+        from coverage_analyzer import CoverageAnalyzer
+
+        # each provider's dates are converted once and shared by all of its ticket windows, a window is checked from
+        # its start date, so that the leading days before a provider's data begins are reported as missing
+        provider_arrays = {pid: CoverageAnalyzer.to_dates(dates) for pid, dates in provider_dates.items()}
+        gaps_by_ticket = CoverageAnalyzer.find_gaps([ticket_iter[3] for ticket_iter, results in candidates],
+                                                    [ticket_iter[6] for ticket_iter, results in candidates],
+                                                    [provider_arrays[str(ticket_iter[1])]
+                                                     for ticket_iter, results in candidates])
+
+        # the missing dates of the tickets held back are posted to them, without the label, each time they change
+        reports = store if store is not None else CoverageStore(self.coverage_store_path, self.coverage_rescan_days)
+        try:
+            for (ticket_iter, results), gaps in zip(candidates, gaps_by_ticket):
+                missing_days = CoverageAnalyzer.missing_days(gaps)
+                missing_dates = CoverageAnalyzer.gap_summary(gaps)
+                self.logger.info("Ticket {} missing {} day(s): {}".format(ticket_iter[0], missing_days, missing_dates))
+                # a provider whose earliest transaction date falls after the post period has no data in the window
+                in_window = str(results[2])[:10] <= ticket_iter[6]
+                if in_window and missing_days <= self.allowed_missing_days:
+                    reports.clear_gaps(ticket_iter[0])
+                    self.ticket_manager(ticket_iter, results, missing_dates)
+                else:
+                    metrics.increment('gap_rejected_tickets')
+                    self.ticket_manager(ticket_iter, None)
+                    if reports.report_gaps(ticket_iter[0], missing_dates, today_date):
+                        self.write_back.put(ticket_iter[0], ticket_iter[7].self,
+                                            self.jira_pars.transaction_data_message(ticket_iter[0], ticket_iter[5],
+                                                                                    results, missing_dates, False),
+                                            label=False)
+                        self.logger.info("The missing dates comment of Ticket {} has been queued for Jira"
+                                         .format(ticket_iter[0]))
+        finally:
+            if store is None:
+                reports.close()
+
     # Confirms output of query, posts results to Jira ticket, transitions ticket to 'Analytics Processes' status
     #
-    def ticket_manager(self, ticket_iter, results):
+    @ticket_logged
+    def ticket_manager(self, ticket_iter, results, missing_dates=None):
         # verify completeness/existence of results
         if results is not None:
             # writes found data to log file, comments data to ticket, finally transitions ticket
             self.logger.info("Qubole results: Total days: {}, Total transaction date count: {}, "
                              "Earliest Transaction Date: {}, Latest Transaction Date: {}"
                              .format(results[0], results[1], results[2], results[3]))
-            self.jira_pars.add_transaction_data_comment(ticket_iter[0], ticket_iter[5], results)
-            self.logger.info("A ticket alert has been added as a comment to Jira Ticket: {}".format(ticket_iter[0]))
-            self.jira_pars.update_field_value(ticket_iter[0])
-            #self.jira_pars.progress_ticket(ticket_iter[0])
-            self.logger.info("Ticker {} has had its 'labels' field updated to 'data_complete'".format(ticket_iter[0]))
-            #self.logger.info("Ticket {} has been transitioned to the 'Analytics Processes' status".format(ticket_iter[0]))
+            if self.journal is not None:
+                self.journal.record_ticket(ticket_iter[0], 'write_queued', results)
+            # the comment, label and transition are sent as one write off the query thread
+            self.write_back.put(ticket_iter[0], ticket_iter[7].self,
+                                self.jira_pars.transaction_data_message(ticket_iter[0], ticket_iter[5], results,
+                                                                        missing_dates),
+                                self.jira_transition)
+            metrics.increment('ticket_outcomes', outcome='complete')
+            if self.readiness is not None:
+                self.readiness.record(ticket_iter[0], ticket_iter[1], ticket_iter[6], today_date, True)
+            self.untrack(ticket_iter[0])
+            self.logger.info("The results comment and 'data_complete' label of Ticket {} have been queued for Jira"
+                             .format(ticket_iter[0]))
         else:
             # make no ticket changes if none or incomplete results
+            metrics.increment('ticket_outcomes', outcome='incomplete')
+            if self.readiness is not None:
+                self.readiness.record(ticket_iter[0], ticket_iter[1], ticket_iter[6], today_date, False)
+            if self.journal is not None:
+                self.journal.record_ticket(ticket_iter[0], 'incomplete')
+            if self.tracked is not None:
+                self.checked_at[ticket_iter[0]] = time.time()
+            if self.leases is not None:
+                self.leases.release(ticket_iter[0])
             self.logger.info("There is either none or incomplete data, Ticket: {}".format(ticket_iter[0]))
 
         self.logger.info("End of thread\n")
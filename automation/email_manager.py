@@ -1,11 +1,17 @@
 # email_manager module
-# Module holds the class => EmailManager - manages the email creation and the smtp interface
-# Class responsible for all email related management
+# Module holds the classes => EmailManager - manages the email creation and the smtp interface,
+# EmailDispatcher - manages the queued sending of alert emails off the main processing path
+# Classes responsible for all email related management, smtplib is only imported once an email is sent
 #
-from smtplib import SMTP
 from email.message import EmailMessage
+import threading
+import queue
 import logging
 
+from metrics_manager import registry as metrics
+
+MAIL_HOST = 'mailhost.valkyrie.net'
+
 
 class EmailManager(object):
     def __init__(self, ticket, study_id, start_date, pp_end_date, subject, to_address, from_address):
@@ -15,18 +21,27 @@ class EmailManager(object):
         self.subj = subject
         self.to_address = to_address
         self.from_address = from_address
+        self.details = "Ticket: " + self.ticket.key + "\n\n" + \
+                       "Study Number: " + str(study_id) + "\n\n" + \
+                       "Study Start Date (minus 1 yr): " + start_date + "\n\n" + \
+                       "Study Post-Period End Date (plus 1 day): " + pp_end_date + "\n\n"
         self.text = "Retail Analytics,\n\n" + \
                     "There appears to be a problem locating the Provider ID. Please find details below:\n\n" + \
-                    "Ticket: " + self.ticket.key + "\n\n" + \
-                    "Study Number: " + str(study_id) + "\n\n" + \
-                    "Study Start Date (minus 1 yr): " + start_date + "\n\n" + \
-                    "Study Post-Period End Date (plus 1 day): " + pp_end_date + "\n\n" + \
+                    self.details + \
                     "Thanks,\n" + \
                     "The CI Team - in memoriam"
 
-    # Create the email in a text format then send via smtp
+    # Opens an smtp connection to the mail host
     #
-    def retail_emailer(self):
+    @staticmethod
+    def connect():
+        from smtplib import SMTP
+
+        return SMTP(MAIL_HOST)
+
+    # Create the email in a text format then send via smtp, over the given connection when one is passed
+    #
+    def retail_emailer(self, smtp=None):
         try:
             # Simple Text Email
             self.msg = EmailMessage()
@@ -38,12 +53,121 @@ class EmailManager(object):
             self.msg.set_content(self.text)
 
             # Send Email
-            with SMTP('mailhost.valkyrie.net') as smtp:
+            if smtp is not None:
                 smtp.send_message(self.msg)
+            else:
+                with self.connect() as smtp:
+                    smtp.send_message(self.msg)
 
         except Exception as e:
-            self.logger.error = ("Email failed for ticket {} => {}".format(self.ticket.key, e))
+            self.logger.error("Email failed for ticket {} => {}".format(self.ticket.key, e))
+            return False
 
         else:
             self.logger.warning("An alert email for ticket {} has been sent.".format(self.ticket.key))
             self.logger.info("")
+            return True
+
+    # Create one consolidated email listing every alert of the run then send via smtp
+    #
+    @classmethod
+    def digest_emailer(cls, alerts, subject, to_address, from_address):
+        logger = logging.getLogger(__name__)
+        ticket_keys = [alert.ticket.key for alert in alerts]
+        try:
+            msg = EmailMessage()
+            msg['Subject'] = "{} ({} tickets)".format(subject, len(alerts))
+            msg['From'] = from_address
+            msg['To'] = to_address
+            msg.set_content("Retail Analytics,\n\n" +
+                            "There appears to be a problem locating the Provider ID for the following {} tickets. "
+                            "Please find details below:\n\n".format(len(alerts)) +
+                            "----------\n\n".join(alert.details for alert in alerts) +
+                            "Thanks,\n" +
+                            "The CI Team - in memoriam")
+
+            with cls.connect() as smtp:
+                smtp.send_message(msg)
+
+        except Exception as e:
+            logger.error("Digest email failed for tickets {} => {}".format(ticket_keys, e))
+            return False
+
+        else:
+            logger.warning("A digest alert email for tickets {} has been sent.".format(ticket_keys))
+            return True
+
+
+class EmailDispatcher(object):
+    def __init__(self, email_class, subject, to_address, from_address, mode='digest'):
+        self.email_class = email_class
+        self.subject = subject
+        self.to_address = to_address
+        self.from_address = from_address
+        self.mode = mode
+        self.alerts = queue.Queue()
+        self.digest = []
+        self.smtp = None
+        self.thread = None
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    # Queues an alert for a ticket without a provider id, the caller never waits on smtp
+    #
+    def add(self, ticket, study_number, start_date, pp_end_date_adj):
+        alert = self.email_class(ticket, study_number, start_date, pp_end_date_adj, self.subject,
+                                 self.to_address, self.from_address)
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.send, name="Emailer", daemon=True)
+                self.thread.start()
+        self.alerts.put(alert)
+        metrics.increment('email_alerts')
+
+    # Sender thread loop, per-ticket mode sends each alert over one reused connection, digest mode holds them
+    #
+    def send(self):
+        while True:
+            alert = self.alerts.get()
+            if alert is None:
+                break
+            if self.mode == 'digest':
+                self.digest.append(alert)
+                continue
+            try:
+                if self.smtp is None:
+                    self.smtp = self.email_class.connect()
+            except Exception as e:
+                self.logger.error("Smtp connection failed, alert for ticket {} not sent => {}"
+                                  .format(alert.ticket.key, e))
+                continue
+            with metrics.span('email', mode='ticket'):
+                sent = alert.retail_emailer(self.smtp)
+            if not sent:
+                # drop a connection that may be broken, the next alert opens a fresh one
+                self.disconnect()
+
+        if self.digest:
+            with metrics.span('email', mode='digest'):
+                self.email_class.digest_emailer(self.digest, self.subject, self.to_address, self.from_address)
+            self.digest = []
+        self.disconnect()
+
+    # Closes the reused connection, ignoring one that is already broken
+    #
+    def disconnect(self):
+        if self.smtp is not None:
+            try:
+                self.smtp.quit()
+            except Exception:
+                pass
+            self.smtp = None
+
+    # Sends anything still queued, the digest in digest mode, waiting at most timeout seconds
+    #
+    def close(self, timeout=120):
+        with self.lock:
+            thread, self.thread = self.thread, None
+        if thread is not None:
+            self.alerts.put(None)
+            thread.join(timeout)
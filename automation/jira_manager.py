@@ -3,70 +3,94 @@
 # Class responsible for all JIRA related interactions including ticket searching, data pull, file attaching, comment
 # posting and field updating.
 #
-from jira import JIRA
 from datetime import datetime, timedelta
 from urllib.parse import urlparse
+import json
+
+from metrics_manager import registry as metrics
 
 
 class JiraManager(object):
-    def __init__(self, url, jira_token):
-        self.tickets = []
+    def __init__(self, url, jira_token, page_size=100):
+        from jira import JIRA
+
         self.jira = JIRA(url, basic_auth=jira_token)
         self.date_range = ""
         self.file_name = ""
-        self.hub_study_number = ""
-        self.pp_end_date = ""
-        self.pp_end_date_adj = ""
-        self.start_date = ""
-        self.lead_analyst = None
         self.today_date = (datetime.now() - timedelta(hours=6)).strftime('%m/%d/%Y')
         self.transaction_data_alert = 'transaction data has been found '
+        self.missing_data_alert = 'transaction data is missing dates '
         self.attn_default = 'retailanalytics'
         self.ticket_transitionid = '51'   # id for 'Analytics Processes'
+        self.page_size = int(page_size)
+        # only the fields read by the pipeline are requested, the search records are used throughout the run
+        self.search_fields = 'customfield_17018,customfield_11426,customfield_10431,customfield_12325,reporter,labels'
 
-    # Searches Jira for all tickets that match the parent ticket query criteria
+    # Yields the tickets that match the parent ticket query criteria page by page, requesting only the used fields,
+    # limited to the tickets updated within the last updated_within minutes when given, the relative time is read by
+    # Jira against its own clock so that it does not depend on the time zone of this host
     #
-    def find_tickets(self, jira_type, jira_status, labels, vertical, media_partner, data_source_hub, text):
-        # Query to find corresponding Jira Tickets
-        self.tickets = []
+    def iter_tickets(self, jira_type, jira_status, labels, vertical, media_partner, data_source_hub, text,
+                     updated_within=None):
         jql_query = "Project in (CAM) AND Type = " + jira_type + " AND Status in " + jira_status + " AND labels not in " + labels + " AND Vertical in " \
                     + vertical + " AND 'Media Partner - HUB' not in " + media_partner + " AND 'Data Source - HUB' ~ " \
                     + data_source_hub + " AND Summary ~ " + text
-        self.tickets = self.jira.search_issues(jql_query, maxResults=500)
-        if len(self.tickets) > 0:
-            return self.tickets
-        else:
-            return None
+        if updated_within is not None:
+            jql_query += " AND updated >= -" + str(updated_within) + "m"
+        return self.iter_search(jql_query, self.search_fields)
+
+    # Yields every project ticket updated within the last updated_within minutes whatever its status or labels, so that
+    # the tickets that no longer match the query criteria can be told apart from those that still do
+    #
+    def iter_updated(self, updated_within):
+        return self.iter_search("Project in (CAM) AND updated >= -" + str(updated_within) + "m", 'labels')
+
+    # Yields the tickets of a search page by page in key order, each page starts after the last key of the one before,
+    # since tickets labelled while the search is paging drop out of the results and would shift a startAt offset past
+    # tickets not yet returned
+    #
+    def iter_search(self, jql_query, fields):
+        last_key = None
+        while True:
+            page_query = jql_query if last_key is None else jql_query + " AND key > " + last_key
+            with metrics.span('jira_search'):
+                page = self.jira.search_issues(page_query + " ORDER BY key ASC", startAt=0,
+                                               maxResults=self.page_size, fields=fields)
+            for ticket in page:
+                yield ticket
+            # the server may cap a page below page_size, so paging ends once a page holds every ticket left to return
+            if not page or len(page) >= page.total:
+                break
+            last_key = page[-1].key
 
     # Retrieves the hub study number from ticket to populate api study call convert to integer type, also returns
-    # the post-period end date and start date for hive query
+    # the post-period end date and start date for hive query, read from the search record without a re-fetch
     #
     def ticket_information_pull(self, ticket):
-        ticket = self.jira.issue(ticket.key)
         # Converts field value returned link url to tuple via urlparse, selects the item that represents the path [-4],
         # parse this item before selecting the last item [-1] from this string after splitting on '/'
-        self.hub_study_number = int(urlparse(ticket.fields.customfield_17018)[-4].split('/')[-1].strip())
+        hub_study_number = int(urlparse(ticket.fields.customfield_17018)[-4].split('/')[-1].strip())
         # set the Post-period end date to a plus one day
-        self.pp_end_date = datetime.strptime(ticket.fields.customfield_11426, "%Y-%m-%d").strftime("%Y-%m-%d")
-        self.pp_end_date_adj = (datetime.strptime(ticket.fields.customfield_11426, "%Y-%m-%d") + timedelta(days=1))\
+        pp_end_date = datetime.strptime(ticket.fields.customfield_11426, "%Y-%m-%d").strftime("%Y-%m-%d")
+        pp_end_date_adj = (datetime.strptime(ticket.fields.customfield_11426, "%Y-%m-%d") + timedelta(days=1))\
             .strftime("%Y-%m-%d")
         # set the start date to a minus one year
-        self.start_date = (datetime.strptime(ticket.fields.customfield_10431, "%Y-%m-%d") - timedelta(days=365))\
+        start_date = (datetime.strptime(ticket.fields.customfield_10431, "%Y-%m-%d") - timedelta(days=365))\
             .strftime("%Y-%m-%d")
         lead_analyst = ticket.fields.customfield_12325
-        # check to see if lead analyst field is populated, if not substitute with default
+        # check to see if lead analyst field is populated, if not substitute with default, values are kept local
+        # so that tickets can be pulled from several threads at once
         if lead_analyst is not None:
-            self.lead_analyst = '.'.join(str(lead_analyst).split(' '))
+            lead_analyst = '.'.join(str(lead_analyst).split(' '))
         else:
-            self.lead_analyst = self.attn_default
+            lead_analyst = self.attn_default
 
-        return self.hub_study_number, self.pp_end_date_adj, self.start_date, self.lead_analyst, self.pp_end_date
+        return hub_study_number, pp_end_date_adj, start_date, lead_analyst, pp_end_date
 
-    # Add a comment to ticket informing lead analyst of data availability and post qubole results
+    # Builds the results comment informing lead analyst of data availability, with any missing date ranges, the alert
+    # of an incomplete ticket instead says that its data is missing dates
     #
-    def add_transaction_data_comment(self, ticket_key, lead_analyst, results):
-        cam_ticket = self.jira.issue(ticket_key)
-        reporter = cam_ticket.fields.reporter.key
+    def transaction_data_message(self, ticket_key, lead_analyst, results, missing_dates=None, complete=True):
         message = """[~{attention}], {transaction_data_alert} for Ticket =>    *{ticket_id}*
         
                      ||Return Parameter||Result||
@@ -74,28 +98,40 @@ class JiraManager(object):
                      |Distinct Days Transaction Count|{trans}|
                      |Earliest Transaction Date|{min}|
                      |Final Transaction Date|{max}|
-                     """.format(reporter, attention=lead_analyst,
-                                transaction_data_alert=self.transaction_data_alert,
+                     """.format(attention=lead_analyst,
+                                transaction_data_alert=self.transaction_data_alert if complete
+                                else self.missing_data_alert,
                                 ticket_id=ticket_key,
                                 days=results[0],
                                 trans=results[1],
                                 min=results[2],
                                 max=results[3]
                                 )
-        self.jira.add_comment(issue=cam_ticket, body=message)
+        # add the missing date ranges found by the per-day coverage check
+        if missing_dates is not None:
+            message += "|Missing Transaction Dates|{}|\n".format(missing_dates)
+        return message
+
+    # Writes the results comment and the 'data_complete' label of a ticket in one request, from the issue url alone so
+    # that persisted writes can be replayed, without the label only the comment is written
+    #
+    def update_ticket(self, issue_url, message, label=True):
+        update = {'comment': [{'add': {'body': message}}]}
+        if label:
+            update['labels'] = [{'add': u'data_complete'}]
+        self.put_issue(issue_url, {'update': update})
 
-    # Transition the ticket status field to 'Analytics Processes'
+    # Transitions the ticket status field to 'Analytics Processes' on its own, the transition screen need not carry the
+    # comment or labels fields
     #
-    def progress_ticket(self, ticket_key):
-        ticket = self.jira.issue(ticket_key)
-        self.jira.transition_issue(ticket, self.ticket_transitionid)
+    def transition_ticket(self, issue_url):
+        self.jira.transition_issue(issue_url.rstrip('/').split('/')[-1], self.ticket_transitionid)
 
-    # Change the field 'labels' in the child ticket to the value 'data_complete' to omit from future search results
+    # Sends an issue edit to its REST url through the client's authenticated session, the jira library has no public
+    # call that edits an issue by url without fetching it first, so this is the only use of its private session
     #
-    @staticmethod
-    def update_field_value(ticket):
-        ticket.fields.labels.append(u'data_complete')
-        ticket.update(fields={'labels': ticket.fields.labels})
+    def put_issue(self, issue_url, payload):
+        return self.jira._session.put(issue_url, data=json.dumps(payload))
 
     # Ends the current JIRA session
     #
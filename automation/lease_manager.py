@@ -0,0 +1,100 @@
+# lease_manager module
+# Module holds the class => LeaseManager - manages the ticket leases shared by several crawler nodes
+# Class responsible for granting each due ticket to a single node through a lease table in a shared SQLite database,
+# renewing the held leases from a heartbeat thread while their queries run, marking a ticket done once its results are
+# written to Jira and releasing the rest, so that a ticket held by a node that dies is taken over once its lease expires
+#
+import threading
+import sqlite3
+import time
+import logging
+
+from metrics_manager import registry as metrics
+
+
+class LeaseManager(object):
+    def __init__(self, db_path, node, lease_minutes, cooldown_minutes, retention_days):
+        self.db_path = db_path
+        self.node = node
+        self.lease_seconds = float(lease_minutes) * 60
+        self.cooldown_seconds = float(cooldown_minutes) * 60
+        self.retention_seconds = float(retention_days) * 86400
+        self.held = set()
+        self.heartbeat = None
+        self.lock = threading.Lock()
+        # autocommit mode, every change is made in an explicit immediate transaction
+        self.conn = sqlite3.connect(self.db_path, timeout=60, check_same_thread=False, isolation_level=None)
+        self.logger = logging.getLogger(__name__)
+        with self.lock:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS leases ("
+                              "ticket_key TEXT PRIMARY KEY, node TEXT NOT NULL, expires REAL NOT NULL, "
+                              "done INTEGER NOT NULL DEFAULT 0)")
+            self.conn.execute("DELETE FROM leases WHERE done = 1 AND expires < ?",
+                              (time.time() - self.retention_seconds,))
+
+    # Takes the lease of a ticket, returns False while another node or another manager of this node holds it, or once
+    # any node has completed it, a node may take back its own lease left by an earlier run
+    #
+    def acquire(self, ticket_key):
+        now = time.time()
+        with self.lock:
+            if ticket_key in self.held:
+                return False
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute("SELECT node, expires, done FROM leases WHERE ticket_key = ?",
+                                        (ticket_key,)).fetchone()
+                acquired = row is None or (not row[2] and (row[0] == self.node or row[1] < now))
+                if acquired:
+                    self.conn.execute("INSERT OR REPLACE INTO leases (ticket_key, node, expires, done) "
+                                      "VALUES (?, ?, ?, 0)", (ticket_key, self.node, now + self.lease_seconds))
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+            if acquired:
+                self.held.add(ticket_key)
+                if self.heartbeat is None:
+                    self.heartbeat = threading.Thread(target=self.renew, name="Leases", daemon=True)
+                    self.heartbeat.start()
+        metrics.increment('ticket_leases', outcome='acquired' if acquired else 'skipped')
+        if not acquired:
+            self.logger.info("Ticket {} is leased to another node, it will not be processed here".format(ticket_key))
+        return acquired
+
+    # Lets another node take the ticket once the cooldown has passed, used when the ticket is left incomplete
+    #
+    def release(self, ticket_key):
+        self.update(ticket_key, "expires = ?", time.time() + self.cooldown_seconds)
+
+    # Marks the ticket done once its results are in Jira, no node takes it again
+    #
+    def complete(self, ticket_key):
+        self.update(ticket_key, "done = 1, expires = ?", time.time())
+
+    # Applies a change to a lease this node holds and stops renewing it
+    #
+    def update(self, ticket_key, assignment, expires):
+        with self.lock:
+            if ticket_key not in self.held:
+                return
+            self.held.discard(ticket_key)
+            self.conn.execute("UPDATE leases SET {} WHERE ticket_key = ? AND node = ? AND done = 0".format(assignment),
+                              (expires, ticket_key, self.node))
+
+    # Heartbeat thread loop, extends the held leases every third of the lease period, ends once none are held
+    #
+    def renew(self):
+        while True:
+            time.sleep(self.lease_seconds / 3)
+            with self.lock:
+                if not self.held:
+                    self.heartbeat = None
+                    return
+                held = sorted(self.held)
+                try:
+                    self.conn.executemany("UPDATE leases SET expires = ? WHERE ticket_key = ? AND node = ? AND done = 0",
+                                          [(time.time() + self.lease_seconds, ticket_key, self.node)
+                                           for ticket_key in held])
+                except Exception as e:
+                    self.logger.error("Lease renewal of {} ticket(s) failed => {}".format(len(held), e))
@@ -0,0 +1,88 @@
+# local_sql_engine module
+# Module holds the class => LocalSqlEngine - manages the embedded SQLite query engine
+# Class responsible for running the transaction queries and summary statements, written in the 'local' dialect, against
+# a SQLite database attached as 'core_shared' that holds a synthetic transaction table, answering with the same typed
+# rows as the Qubole engines so that the whole query path can be load tested without a cluster
+#
+import sqlite3
+import time
+import logging
+
+from metrics_manager import registry as metrics
+
+
+class LocalSqlEngine(object):
+    def __init__(self, name, db_path, query):
+        self.name = name
+        self.db_path = db_path
+        self.query = query
+        self.queue_seconds = None
+        self.logger = logging.getLogger(__name__)
+
+    # Runs the query, returns the first row as a list, None when there is no row or a null value
+    #
+    def get_results(self):
+        rows = self.get_result_rows()
+        results = next(rows, None) if rows is not None else None
+        if results is None or None in results:
+            return None
+        return list(results)
+
+    # Runs the query, returns an iterator of the result rows as tuples, None on failure
+    #
+    def get_result_rows(self):
+        started = time.time()
+        try:
+            conn = sqlite3.connect(':memory:')
+            try:
+                conn.execute("ATTACH DATABASE ? AS core_shared", (self.db_path,))
+                rows = conn.execute(self.query).fetchall()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            self.logger.error("Local query {} failed => {}".format(", ".join(self.name), e))
+            metrics.increment('hive_command_status', status='error', cluster='local', engine='local')
+            return None
+        # a local query never waits in a queue
+        self.queue_seconds = 0.0
+        metrics.observe('hive_run_seconds', time.time() - started, cluster='local')
+        metrics.increment('hive_command_status', status='done', cluster='local', engine='local')
+        return iter(rows)
+
+    # Runs a statement that returns no rows, returns True once it has been committed
+    #
+    def execute(self):
+        try:
+            conn = sqlite3.connect(':memory:')
+            try:
+                conn.execute("ATTACH DATABASE ? AS core_shared", (self.db_path,))
+                with conn:
+                    conn.execute(self.query)
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            self.logger.error("Local statement {} failed => {}".format(", ".join(self.name), e))
+            metrics.increment('hive_command_status', status='error', cluster='local', engine='local')
+            return False
+        self.queue_seconds = 0.0
+        metrics.increment('hive_command_status', status='done', cluster='local', engine='local')
+        return True
+
+    # Creates the synthetic transaction table from the transaction dates of each provider, one 'P' transaction per
+    # date for each of the given times of day, replacing any earlier table
+    # provider_dates: dict of {provider_id: list of 'YYYY-MM-DD' transaction dates}
+    #
+    @staticmethod
+    def load(db_path, provider_dates, times=('12:00:00',)):
+        conn = sqlite3.connect(db_path)
+        try:
+            with conn:
+                conn.execute('DROP TABLE IF EXISTS "transaction"')
+                conn.execute('CREATE TABLE "transaction" (provider_id INTEGER, txn_type TEXT, txn_dt TEXT)')
+                conn.executemany('INSERT INTO "transaction" VALUES (?, ?, ?)',
+                                 ((int(pid), 'P', "{} {}".format(date, time_of_day))
+                                  for pid, dates in provider_dates.items() for date in dates
+                                  for time_of_day in times))
+                conn.execute('CREATE INDEX transaction_provider ON "transaction" (provider_id, txn_dt)')
+        finally:
+            conn.close()
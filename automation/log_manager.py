@@ -0,0 +1,96 @@
+# log_manager module
+# Module holds the classes => TicketContextFilter, JsonFormatter and LogManager - manages non-blocking logging
+# Classes responsible for routing every log record through an in-memory queue drained by a single writer thread, so
+# that no worker thread waits on the log file or its lock, with the key of the ticket a thread is working on attached
+# to each record so that a ticket's lines can be grouped, as plain text or as one json object per line
+#
+from contextlib import contextmanager
+import contextvars
+import functools
+import logging
+import logging.handlers
+import queue
+import json
+
+# the key of the ticket the current thread is working on, '-' outside of any ticket
+current_ticket = contextvars.ContextVar('current_ticket', default='-')
+
+
+# Attaches the key of the ticket being worked on to every log record within the block
+#
+@contextmanager
+def ticket_scope(ticket_key):
+    token = current_ticket.set(ticket_key)
+    try:
+        yield
+    finally:
+        current_ticket.reset(token)
+
+
+# Decorates a manager method taking a ticket iterable as its first argument, attaching the ticket's key to every log
+# record made within the method
+#
+def ticket_logged(method):
+    @functools.wraps(method)
+    def wrapper(self, ticket_iter, *args, **kwargs):
+        with ticket_scope(ticket_iter[0] if ticket_iter else '-'):
+            return method(self, ticket_iter, *args, **kwargs)
+    return wrapper
+
+
+class TicketContextFilter(logging.Filter):
+    # Sets the record's ticket attribute in the logging thread, before the record is queued
+    #
+    def filter(self, record):
+        if not hasattr(record, 'ticket'):
+            record.ticket = current_ticket.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    # Formats a record as a single line json object
+    #
+    def format(self, record):
+        entry = {'time': self.formatTime(record, self.datefmt), 'level': record.levelname, 'logger': record.name,
+                 'thread': record.threadName, 'ticket': getattr(record, 'ticket', '-'),
+                 'message': record.getMessage()}
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+class LogManager(object):
+    def __init__(self, handlers, level=logging.INFO, fmt=None, datefmt=None, json_format=False):
+        self.handlers = handlers
+        self.level = level
+        self.formatter = JsonFormatter(datefmt=datefmt) if json_format else logging.Formatter(fmt, datefmt)
+        self.queue = queue.SimpleQueue()
+        self.listener = None
+        self.logger = logging.getLogger(__name__)
+
+    # Replaces the root logger's handlers with the queue handler and starts the writer thread draining the queue into
+    # the given handlers
+    #
+    def start(self):
+        for handler in self.handlers:
+            if handler.formatter is None:
+                handler.setFormatter(self.formatter)
+        queue_handler = logging.handlers.QueueHandler(self.queue)
+        queue_handler.addFilter(TicketContextFilter())
+        root = logging.getLogger('')
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        root.addHandler(queue_handler)
+        root.setLevel(self.level)
+        self.listener = logging.handlers.QueueListener(self.queue, *self.handlers, respect_handler_level=True)
+        self.listener.start()
+        return self
+
+    # Writes out the records still queued, stops the writer thread and closes the handlers
+    #
+    def stop(self):
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+        for handler in self.handlers:
+            handler.close()
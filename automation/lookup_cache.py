@@ -0,0 +1,87 @@
+# lookup_cache module
+# Module holds the class => LookupCache - manages the persistent on-disk cache of api lookups
+# Class responsible for storing, expiring and evicting the study -> parent company id and parent company id -> provider
+# id lookups, keeping missing values (negative results) for a shorter time-to-live than found values
+#
+import threading
+import sqlite3
+import json
+import time
+import logging
+
+
+class LookupCache(object):
+    def __init__(self, db_path, ttl_hours, negative_ttl_hours, max_entries):
+        self.db_path = db_path
+        self.ttl = float(ttl_hours) * 3600
+        self.negative_ttl = float(negative_ttl_hours) * 3600
+        self.max_entries = int(max_entries)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.hits = 0
+        self.misses = 0
+        # last use times of the hits since the last write, so that a hit does not wait on a database write
+        self.touched = {}
+        self.logger = logging.getLogger(__name__)
+        with self.lock, self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS lookups ("
+                              "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT, "
+                              "expires REAL NOT NULL, accessed REAL NOT NULL, "
+                              "PRIMARY KEY (namespace, key))")
+
+    # Returns a tuple of (found, value), value is None for a cached negative result, the last use time of a hit is
+    # only noted in memory and written with the next write to the cache
+    #
+    def get(self, namespace, key):
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT value, expires FROM lookups WHERE namespace = ? AND key = ?",
+                                    (namespace, str(key))).fetchone()
+            if row is None or row[1] < now:
+                self.misses += 1
+                return False, None
+            self.touched[(namespace, str(key))] = now
+            self.hits += 1
+            return True, json.loads(row[0])
+
+    # Stores a lookup result, None values are stored as negative results with the shorter ttl
+    #
+    def put(self, namespace, key, value):
+        now = time.time()
+        expires = now + (self.negative_ttl if value is None else self.ttl)
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO lookups (namespace, key, value, expires, accessed) "
+                              "VALUES (?, ?, ?, ?, ?)", (namespace, str(key), json.dumps(value), expires, now))
+            self.write_touched()
+            self.evict(now)
+
+    # Writes the last use times of the hits noted since the last write
+    #
+    def flush(self):
+        with self.lock, self.conn:
+            self.write_touched()
+
+    # Writes the noted last use times in one statement, called with the lock held
+    #
+    def write_touched(self):
+        if self.touched:
+            self.conn.executemany("UPDATE lookups SET accessed = ? WHERE namespace = ? AND key = ?",
+                                  [(accessed, namespace, key) for (namespace, key), accessed in self.touched.items()])
+            self.touched = {}
+
+    # Removes expired entries, then the least recently used entries above the size bound
+    #
+    def evict(self, now):
+        self.conn.execute("DELETE FROM lookups WHERE expires < ?", (now,))
+        excess = self.conn.execute("SELECT COUNT(*) FROM lookups").fetchone()[0] - self.max_entries
+        if excess > 0:
+            self.conn.execute("DELETE FROM lookups WHERE rowid IN "
+                              "(SELECT rowid FROM lookups ORDER BY accessed LIMIT ?)", (excess,))
+
+    # Closes the cache connection
+    #
+    def close(self):
+        with self.lock:
+            with self.conn:
+                self.write_touched()
+            self.conn.close()
@@ -43,42 +43,56 @@
 # Responsible for reading in the basic configurations settings, creating the log file, and creating and launching
 # the Retail Data Crawler Manager (RDCM), finally it launches the purge_files method to remove log files that are older
 # than a prescribed retention period.
-# A console logger option is offered via keyboard input for development purposes when the main.py script is invoked.
+# With service mode enabled the manager stays resident instead, running a cycle every service interval against the
+# tickets updated since its last Jira search, with the log file rolled over at midnight.
+# Several configuration files may be given, one manager is run for each in the same process sharing their clients and
+# caches, the first file sets the log file and metrics paths. With leases enabled several hosts share the tickets.
+# Log records are queued and written by a single writer thread, each tagged with the ticket it concerns, as plain text
+# or as one json object per line.
+# A console logger option is offered via the --console flag for development purposes when the main.py script is invoked.
 # For production, import main as a module and launch the main function as main.main(), which uses 'n' as the default
 # input to the the console logger run option.
+# Usage: python main.py [--console] [--config config.ini [other.ini ...]] [--service y|n]
 #
 from datetime import datetime, timedelta
+import argparse
 import os
 import configparser
 import logging
+import logging.handlers
+import threading
+import signal
 
 from data_crawler_manager import DataCrawlerManager
+from resource_pool import ResourcePool
+from log_manager import LogManager
+from metrics_manager import registry as metrics
 
 
-# Define a console logger for development purposes
+# Define a console logger for development purposes, returns the handler to be added to the log writer
 #
 def console_logger():
     # define Handler that writes DEBUG or higher messages to the sys.stderr
     console = logging.StreamHandler()
     console.setLevel(logging.DEBUG)
     # set a simple format for console use
-    formatter = logging.Formatter('%(levelname)-7s: %(name)-30s: %(threadName)-12s: %(message)s')
+    formatter = logging.Formatter('%(levelname)-7s: %(name)-30s: %(threadName)-12s: %(ticket)-10s: %(message)s')
     console.setFormatter(formatter)
-    # add the Handler to the root logger
-    logging.getLogger('').addHandler(console)
+    return console
 
 
-def main(con_opt='n'):
-    today_date = (datetime.now() - timedelta(hours=6)).strftime('%Y%m%d-%H%M%S')
-
+# Reads the configuration file, returns the configparser object and the dictionary of configuration parameters
+#
+def read_config(config_file='config.ini'):
     # create a configparser object and open in read mode
     config = configparser.ConfigParser()
-    config.read('config.ini')
+    config.read(config_file)
 
     # create a dictionary of configuration parameters
     config_params = {
         "jira_url":             config.get('Jira', 'url'),
         "jira_token":           tuple(config.get('Jira', 'authorization').split(',')),
+        "jira_transition":      config.get('Jira', 'transition', fallback='n'),
         "jql_type":             config.get('Jira', 'type'),
         "jql_status":           config.get('Jira', 'status'),
         "jql_labels":           config.get('Jira', 'labels'),
@@ -86,45 +100,194 @@ def main(con_opt='n'):
         "jql_media_partner":    config.get('Jira', 'media_partner'),
         "jql_data_source_hub":  config.get('Jira', 'data_source_hub'),
         "jql_text":             config.get('Jira', 'text'),
+        "jira_page_size":       config.get('Jira', 'page_size', fallback='100'),
+        "writeback_path":       config.get('WriteBack', 'path', fallback='jira_pending.json'),
+        "writeback_workers":    config.get('WriteBack', 'workers', fallback='4'),
+        "writeback_retries":    config.get('WriteBack', 'retries', fallback='3'),
+        "writeback_backoff_seconds": config.get('WriteBack', 'backoff_seconds', fallback='2'),
         "qubole_token":         config.get('Qubole', 'bradruck-prod-operations-consumer'),
         "cluster_label":        config.get('Qubole', 'cluster-label'),
+        "max_in_flight":        config.get('Qubole', 'max_in_flight', fallback='8'),
+        "min_in_flight":        config.get('Qubole', 'min_in_flight', fallback='2'),
+        "target_queue_seconds": config.get('Qubole', 'target_queue_seconds', fallback='120'),
+        "query_mode":           config.get('Qubole', 'query_mode', fallback='ticket'),
+        "probe_enabled":        config.get('Qubole', 'probe', fallback='y'),
+        "prefilter_enabled":    config.get('Qubole', 'prefilter', fallback='y'),
+        "prefilter_lookback_days": config.get('Qubole', 'prefilter_lookback_days', fallback='30'),
+        "coalesce_enabled":     config.get('Qubole', 'coalesce', fallback='y'),
+        "poll_min_seconds":     config.get('Qubole', 'poll_min_seconds', fallback='10'),
+        "poll_max_seconds":     config.get('Qubole', 'poll_max_seconds', fallback='120'),
+        "poll_backoff_ratio":   config.get('Qubole', 'poll_backoff_ratio', fallback='0.1'),
+        "command_timeout_minutes": config.get('Qubole', 'command_timeout_minutes', fallback='180'),
+        "query_engine":         config.get('Qubole', 'engine', fallback='hive'),
+        "interactive_engine":   config.get('Qubole', 'interactive_engine', fallback=''),
+        "interactive_cluster_label": config.get('Qubole', 'interactive_cluster_label', fallback='presto'),
+        "interactive_max_provider_days": config.get('Qubole', 'interactive_max_provider_days', fallback='600'),
+        "local_db_path":        config.get('Qubole', 'local_db', fallback='local_transactions.db'),
+        "summary_enabled":      config.get('Summary', 'enabled', fallback='n'),
+        "summary_table":        config.get('Summary', 'table', fallback='retail_analytics.provider_txn_date_summary'),
+        "summary_registry_path": config.get('Summary', 'registry_path', fallback='summary_registry.db'),
+        "summary_refresh_minutes": config.get('Summary', 'refresh_minutes', fallback='60'),
+        "summary_retention_days": config.get('Summary', 'provider_retention_days', fallback='30'),
+        "summary_rescan_days":  config.get('Summary', 'rescan_days', fallback='7'),
+        "readiness_enabled":    config.get('Readiness', 'enabled', fallback='n'),
+        "readiness_history_path": config.get('Readiness', 'history_path', fallback='readiness_history.db'),
+        "readiness_lag_quantile": config.get('Readiness', 'lag_quantile', fallback='0.1'),
+        "readiness_min_samples": config.get('Readiness', 'min_samples', fallback='5'),
+        "readiness_max_defer_days": config.get('Readiness', 'max_defer_days', fallback='30'),
+        "readiness_recheck_days": config.get('Readiness', 'recheck_days', fallback='7'),
+        "readiness_retention_days": config.get('Readiness', 'retention_days', fallback='365'),
+        "pipeline_enabled":     config.get('Pipeline', 'enabled', fallback='y'),
+        "collect_workers":      config.get('Pipeline', 'collect_workers', fallback='2'),
+        "stage_queue_size":     config.get('Pipeline', 'queue_size', fallback='50'),
+        "gap_check":            config.get('CoverageStore', 'gap_check', fallback='y'),
+        "allowed_missing_days": config.get('CoverageStore', 'allowed_missing_days', fallback='0'),
+        "coverage_store_path":  config.get('CoverageStore', 'path', fallback='coverage_store.db'),
+        "coverage_rescan_days": config.get('CoverageStore', 'rescan_days', fallback='7'),
         "study_url":            config.get('Api', 'study_url', raw=True),
         "account_url":          config.get('Api', 'account_url', raw=True),
+        "api_workers":          config.get('Api', 'workers', fallback='8'),
+        "api_timeout":          config.get('Api', 'timeout', fallback='30'),
+        "api_retries":          config.get('Api', 'retries', fallback='3'),
+        "api_backoff":          config.get('Api', 'backoff_factor', fallback='0.5'),
+        "api_cache_path":       config.get('ApiCache', 'path', fallback='api_cache.db'),
+        "api_cache_ttl_hours":  config.get('ApiCache', 'ttl_hours', fallback='168'),
+        "api_cache_negative_ttl_hours": config.get('ApiCache', 'negative_ttl_hours', fallback='12'),
+        "api_cache_max_entries": config.get('ApiCache', 'max_entries', fallback='10000'),
         "email_subject":        config.get('Email', 'subject'),
         "email_to":             config.get('Email', 'to'),
-        "email_from":           config.get('Email', 'from')
+        "email_from":           config.get('Email', 'from'),
+        "email_mode":           config.get('Email', 'mode', fallback='digest'),
+        "log_format":           config.get('LogFile', 'format', fallback='text'),
+        "metrics_textfile":     config.get('Metrics', 'textfile', fallback='retail_transaction_data_crawler.prom'),
+        "metrics_json":         config.get('Metrics', 'json', fallback='retail_transaction_data_crawler_run.json'),
+        "service_enabled":      config.get('Service', 'enabled', fallback='n'),
+        "service_interval_minutes": config.get('Service', 'interval_minutes', fallback='30'),
+        "service_watermark_overlap_minutes": config.get('Service', 'watermark_overlap_minutes', fallback='5'),
+        "service_recheck_minutes": config.get('Service', 'recheck_minutes', fallback='120'),
+        "journal_enabled":      config.get('Journal', 'enabled', fallback='y'),
+        "journal_path":         config.get('Journal', 'path', fallback='run_journal.db'),
+        "journal_max_age_hours": config.get('Journal', 'max_age_hours', fallback='12'),
+        "journal_retention_days": config.get('Journal', 'retention_days', fallback='7'),
+        "lease_enabled":        config.get('Lease', 'enabled', fallback='n'),
+        "lease_path":           config.get('Lease', 'path', fallback='ticket_leases.db'),
+        "lease_node":           config.get('Lease', 'node', fallback=''),
+        "lease_minutes":        config.get('Lease', 'lease_minutes', fallback='15'),
+        "lease_cooldown_minutes": config.get('Lease', 'cooldown_minutes', fallback='60'),
+        "lease_retention_days": config.get('Lease', 'retention_days', fallback='30')
     }
+    return config, config_params
+
+
+# Runs the method of every manager, each in its own thread when there are several
+#
+def run_managers(managers, method, *args):
+    if len(managers) == 1:
+        getattr(managers[0], method)(*args)
+        return
+    threads = [threading.Thread(target=getattr(manager, method), args=args, name="Config-{}".format(number + 1))
+               for number, manager in enumerate(managers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def main(con_opt='n', config_file='config.ini', service=None):
+    today_date = (datetime.now() - timedelta(hours=6)).strftime('%Y%m%d-%H%M%S')
+
+    # one or more configuration files, the first sets the log file, metrics and retention settings
+    configs = [read_config(file_name) for file_name in ([config_file] if isinstance(config_file, str)
+                                                        else config_file)]
+    if service is not None:
+        for _, params in configs:
+            params['service_enabled'] = service
+    config, config_params = configs[0]
 
     # logfile path to point to the Operations_limited drive on zfs
     purge_days = config.get('LogFile', 'retention_days')
     log_file_path = config.get('LogFile', 'path')
     logfile_name = '{}{}_{}.log'.format(log_file_path, config.get('Project Details', 'app_name'), today_date)
 
+    service_enabled = config_params['service_enabled'] in ['y', 'Y', 'yes', 'true', 'True']
+
     # check to see if log file already exits for the day to avoid duplicate execution
     if not os.path.isfile(logfile_name):
-        logging.basicConfig(filename=logfile_name,
-                            level=logging.INFO,
-                            format='%(asctime)s: %(levelname)-7s: %(name)-30s: %(threadName)-12s: %(message)s',
-                            datefmt='%m/%d/%Y %H:%M:%S')
-
-        logger = logging.getLogger(__name__)
+        # a resident service rolls its log file over at midnight rather than writing one file forever
+        if service_enabled:
+            handlers = [logging.handlers.TimedRotatingFileHandler(logfile_name, when='midnight')]
+        else:
+            handlers = [logging.FileHandler(logfile_name)]
 
         # checks for console logger option, default value set to 'n' to not run in production
         if con_opt and con_opt in ['y', 'Y']:
-            console_logger()
+            handlers.append(console_logger())
+
+        # the threads only queue their records, the handlers are written by the log writer's own thread
+        log_writer = LogManager(handlers, logging.INFO,
+                                '%(asctime)s: %(levelname)-7s: %(name)-30s: %(threadName)-12s: %(ticket)-10s: '
+                                '%(message)s', '%m/%d/%Y %H:%M:%S', config_params['log_format'] == 'json').start()
+        try:
+            logger = logging.getLogger(__name__)
+            logger.info("Process Start - Daily Transaction Data Crawler, Retail - {}\n".format(today_date))
+
+            # create an RDCM object per configuration sharing one resource pool and launch the process managers
+            metrics.reset()
+            resources = ResourcePool()
+            managers = [DataCrawlerManager(params, resources) for _, params in configs]
+            retail_trans = managers[0]
+
+            if service_enabled:
+                # stop after the current cycle when the scheduler ends the service
+                signal.signal(signal.SIGTERM, lambda signum, frame: [manager.stop() for manager in managers])
+
+                # export each round's stage timings and counters, purging old log files once a day, the metrics are
+                # process wide so a round is exported and reset once every manager has finished its cycle, each manager
+                # waiting for the others before its next cycle
+                purged = []
+
+                def export_round():
+                    metrics.export_prometheus(config_params['metrics_textfile'])
+                    metrics.export_json(config_params['metrics_json'])
+                    metrics.reset()
+                    if datetime.now().date() not in purged:
+                        purged[:] = [datetime.now().date()]
+                        retail_trans.purge_files(purge_days, log_file_path)
+
+                cycle_round = threading.Barrier(len(managers), action=export_round)
+                export_lock = threading.Lock()
+
+                # once a manager has stopped the others no longer wait for it, their last cycles are exported as is
+                def after_cycle():
+                    try:
+                        cycle_round.wait()
+                    except threading.BrokenBarrierError:
+                        with export_lock:
+                            metrics.export_prometheus(config_params['metrics_textfile'])
+                            metrics.export_json(config_params['metrics_json'])
+
+                run_managers(managers, 'service_manager', after_cycle, cycle_round.abort)
+                logger.info("Process End - Transaction Data Crawler service, Retail\n")
+                return
 
-        logger.info("Process Start - Daily Transaction Data Crawler, Retail - {}\n".format(today_date))
+            run_managers(managers, 'process_manager')
 
-        # create RDCM object and launch the process manager
-        retail_trans = DataCrawlerManager(config_params)
-        retail_trans.process_manager()
+            # export the run's stage timings and counters
+            metrics.export_prometheus(config_params['metrics_textfile'])
+            metrics.export_json(config_params['metrics_json'])
 
-        # search logfile directory for old log files to purge
-        retail_trans.purge_files(purge_days, log_file_path)
+            # search logfile directory for old log files to purge
+            retail_trans.purge_files(purge_days, log_file_path)
+        finally:
+            # write out the queued records before the process ends
+            log_writer.stop()
 
 
 if __name__ == '__main__':
-    # prompt user for use of console logging -> for use in development not production
-    ans = input("\nWould you like to enable a console logger for this run?\n Please enter y or n:\t")
-    print()
-    main(ans)
+    parser = argparse.ArgumentParser(description="Daily Transaction Data Crawler, Retail")
+    # console logging -> for use in development not production
+    parser.add_argument('--console', action='store_true', help="also log to the console")
+    parser.add_argument('--config', nargs='+', default=['config.ini'], help="one or more configuration files")
+    parser.add_argument('--service', choices=['y', 'n'], help="overrides the [Service] enabled setting")
+    args = parser.parse_args()
+    main('y' if args.console else 'n', args.config, args.service)
@@ -0,0 +1,132 @@
+# metrics_manager module
+# Module holds the class => MetricsManager - manages the run instrumentation
+# Class responsible for timing spans around every stage and external call, counting retries and outcomes, and
+# exporting the run's measurements as a Prometheus textfile and as a json run summary
+#
+from contextlib import contextmanager
+import threading
+import json
+import time
+import os
+
+PREFIX = 'retail_data_crawler'
+
+
+class MetricsManager(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.observations = {}
+        self.counters = {}
+        self.started = time.time()
+
+    # Clears every measurement, used at the start of a run
+    #
+    def reset(self):
+        with self.lock:
+            self.observations = {}
+            self.counters = {}
+            self.started = time.time()
+
+    # Times the enclosed block as an observation of '<name>_seconds', an 'outcome' label records success or error
+    #
+    @contextmanager
+    def span(self, name, **labels):
+        started = time.perf_counter()
+        outcome = 'success'
+        try:
+            yield
+        except Exception:
+            outcome = 'error'
+            raise
+        finally:
+            self.observe('{}_seconds'.format(name), time.perf_counter() - started, **labels)
+            self.increment('{}_outcomes'.format(name), outcome=outcome, **labels)
+
+    # Records a single measured value
+    #
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.observations.setdefault(key, []).append(float(value))
+
+    # Adds to a counter
+    #
+    def increment(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    # Returns the value at quantile q of a sorted list
+    #
+    @staticmethod
+    def quantile(values, q):
+        return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+    # Returns the run summary => count, sum, p50, p95 and max of every observation and the value of every counter
+    #
+    def summary(self):
+        with self.lock:
+            observations = {key: sorted(values) for key, values in self.observations.items()}
+            counters = dict(self.counters)
+        return {
+            'run_seconds': round(time.time() - self.started, 3),
+            'observations': [dict(name=name, labels=dict(labels), count=len(values), sum=round(sum(values), 6),
+                                  p50=round(self.quantile(values, 0.5), 6), p95=round(self.quantile(values, 0.95), 6),
+                                  max=round(values[-1], 6))
+                             for (name, labels), values in sorted(observations.items())],
+            'counters': [dict(name=name, labels=dict(labels), value=value)
+                         for (name, labels), value in sorted(counters.items())]
+        }
+
+    # Writes the run summary as json
+    #
+    def export_json(self, json_path):
+        self.write_atomic(json_path, json.dumps(self.summary(), indent=2))
+
+    # Writes the measurements in the Prometheus textfile collector format, observations as summaries
+    #
+    def export_prometheus(self, textfile_path):
+        summary = self.summary()
+        lines = ['# TYPE {}_run_seconds gauge'.format(PREFIX),
+                 '{}_run_seconds {}'.format(PREFIX, summary['run_seconds'])]
+        typed = set()
+        for observation in summary['observations']:
+            metric = '{}_{}'.format(PREFIX, observation['name'])
+            if metric not in typed:
+                lines.append('# TYPE {} summary'.format(metric))
+                typed.add(metric)
+            for quantile in ('0.5', '0.95'):
+                lines.append('{}{} {}'.format(metric, self.label_text(observation['labels'], quantile=quantile),
+                                              observation['p50' if quantile == '0.5' else 'p95']))
+            lines.append('{}_sum{} {}'.format(metric, self.label_text(observation['labels']), observation['sum']))
+            lines.append('{}_count{} {}'.format(metric, self.label_text(observation['labels']), observation['count']))
+        for counter in summary['counters']:
+            metric = '{}_{}_total'.format(PREFIX, counter['name'])
+            if metric not in typed:
+                lines.append('# TYPE {} counter'.format(metric))
+                typed.add(metric)
+            lines.append('{}{} {}'.format(metric, self.label_text(counter['labels']), counter['value']))
+        self.write_atomic(textfile_path, '\n'.join(lines) + '\n')
+
+    # Formats labels as {name="value",...}, empty when there are none
+    #
+    @staticmethod
+    def label_text(labels, **extra):
+        labels = dict(labels, **extra)
+        if not labels:
+            return ''
+        return '{' + ','.join('{}="{}"'.format(name, str(value).replace('"', '\\"'))
+                              for name, value in sorted(labels.items())) + '}'
+
+    # Writes a file through a temporary file and a rename so collectors never read a partial file
+    #
+    @staticmethod
+    def write_atomic(file_path, text):
+        temp_path = '{}.tmp'.format(file_path)
+        with open(temp_path, 'w') as target:
+            target.write(text)
+        os.replace(temp_path, file_path)
+
+
+# the process wide metrics registry shared by every manager
+registry = MetricsManager()
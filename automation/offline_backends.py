@@ -0,0 +1,330 @@
+# offline_backends module
+# Module holds the classes => OfflineBackend, OfflineJiraManager, OfflineAPICallManager, OfflineQuboleManager,
+# OfflineEmailManager and OfflineCrawlerManager - manages local stand-ins for every external service
+# Classes responsible for replaying recorded or synthetic tickets, api responses and provider transaction dates with
+# configurable latency and failure injection, counting every call so that a full process_manager run can be measured
+# without Jira, the study/account apis, Qubole or the mail host
+#
+from datetime import datetime, timedelta
+import threading
+import random
+import json
+import time
+import re
+import os
+
+from data_crawler_manager import DataCrawlerManager
+from jira_manager import JiraManager
+
+FIXTURE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'offline_fixtures.json')
+
+
+class OfflineBackend(object):
+    def __init__(self, latency=None, failure_rate=None, seed=0):
+        # seconds of latency and the failure probability of each service => jira, api, qubole, email
+        self.latency = {'jira': 0.0, 'api': 0.0, 'qubole': 0.0, 'email': 0.0}
+        self.latency.update(latency or {})
+        self.failure_rate = {'jira': 0.0, 'api': 0.0, 'qubole': 0.0, 'email': 0.0}
+        self.failure_rate.update(failure_rate or {})
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.tickets = []
+        self.studies = {}
+        self.accounts = {}
+        self.provider_dates = {}
+        self.calls = {}
+        # labelled write-backs per ticket key, across every node sharing the backend
+        self.labelled_writes = {}
+
+    # Loads the recorded fixtures => tickets, study -> parent company, parent company -> provider, provider date ranges
+    #
+    def load_fixtures(self, fixture_file=FIXTURE_FILE):
+        with open(fixture_file, 'r') as target:
+            fixtures = json.loads(target.read())
+        for ticket in fixtures['tickets']:
+            self.tickets.append(OfflineTicket(**ticket))
+        self.studies.update({int(study): parent for study, parent in fixtures['studies'].items()})
+        self.accounts.update({int(parent): provider for parent, provider in fixtures['accounts'].items()})
+        for provider, date_ranges in fixtures['providers'].items():
+            self.provider_dates[int(provider)] = sorted(set(date for first, last in date_ranges
+                                                            for date in self.date_range(first, last)))
+        return self
+
+    # Adds synthetic tickets, a share without provider id and a share of providers whose data stops early or has gaps
+    #
+    def synthesize(self, ticket_count, run_date, providers=None, missing_pid_share=0.05):
+        providers = providers or max(1, ticket_count // 3)
+        run_day = datetime.strptime(run_date, '%Y-%m-%d')
+        for provider in range(1, providers + 1):
+            pid = 900000 + provider
+            last_day = run_day - timedelta(days=self.random.choice([1, 1, 1, 5, 30, 90]))
+            dates = self.date_range((last_day - timedelta(days=900)).strftime('%Y-%m-%d'),
+                                    last_day.strftime('%Y-%m-%d'))
+            if self.random.random() < 0.1:
+                gap_start = self.random.randrange(100, 800)
+                del dates[gap_start:gap_start + self.random.randrange(1, 21)]
+            self.provider_dates[pid] = dates
+        # numbered after any recorded tickets so that the keys never collide
+        first_number = max([int(ticket.key.split('-')[-1]) for ticket in self.tickets] + [0]) + 1
+        for number in range(first_number, first_number + ticket_count):
+            study, parent = 500000 + number, 700000 + number
+            self.studies[study] = parent
+            if self.random.random() >= missing_pid_share:
+                self.accounts[parent] = 900000 + self.random.randrange(1, providers + 1)
+            pp_end = run_day - timedelta(days=self.random.randrange(-30, 120))
+            start = pp_end - timedelta(days=self.random.randrange(28, 120))
+            self.tickets.append(OfflineTicket('CAM-{}'.format(number), 'https://hub/studies/{}'.format(study),
+                                              pp_end.strftime('%Y-%m-%d'), start.strftime('%Y-%m-%d'),
+                                              self.random.choice([None, 'Lead Analyst'])))
+        return self
+
+    # Records a call to a service, sleeping for its latency and raising an injected failure
+    #
+    def call(self, service, name):
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+            fail = self.random.random() < self.failure_rate[service]
+        if self.latency[service]:
+            time.sleep(self.latency[service])
+        if fail:
+            raise IOError("Injected {} failure in {}".format(service, name))
+
+    # Returns the inclusive list of 'YYYY-MM-DD' dates between first and last
+    #
+    @staticmethod
+    def date_range(first, last):
+        first_day = datetime.strptime(first, '%Y-%m-%d')
+        return [(first_day + timedelta(days=offset)).strftime('%Y-%m-%d')
+                for offset in range((datetime.strptime(last, '%Y-%m-%d') - first_day).days + 1)]
+
+    # Returns the provider's transaction dates within [start_date, end_date), end_date None for no upper bound
+    #
+    def dates(self, provider_id, start_date, end_date=None):
+        return [date for date in self.provider_dates.get(int(provider_id), [])
+                if date >= start_date[:10] and (end_date is None or date < end_date[:10])]
+
+
+class OfflineTicket(object):
+    def __init__(self, key, study_url, pp_end_date, start_date, lead_analyst=None):
+        self.key = key
+        self.self = 'offline://issue/{}'.format(key)
+        self.fields = OfflineFields(study_url, pp_end_date, start_date, lead_analyst)
+
+    def __str__(self):
+        return self.key
+
+
+class OfflineFields(object):
+    def __init__(self, study_url, pp_end_date, start_date, lead_analyst):
+        self.customfield_17018 = study_url
+        self.customfield_11426 = pp_end_date
+        self.customfield_10431 = start_date
+        self.customfield_12325 = lead_analyst
+        self.reporter = OfflineReporter()
+        self.labels = []
+
+
+class OfflineReporter(object):
+    key = 'reporter'
+
+
+class OfflineResultList(list):
+    def __init__(self, tickets, total):
+        list.__init__(self, tickets)
+        self.total = total
+
+
+# Answers the key cursor searches of the Jira manager => the unlabelled tickets after the cursor key in key order, in
+# pages capped at max_results like a Jira server that caps maxResults, the updated ticket searches find no tickets
+#
+class OfflineJiraClient(object):
+    def __init__(self, backend, max_results=None):
+        self.backend = backend
+        self.max_results = max_results
+
+    def search_issues(self, jql_query, startAt=0, maxResults=50, fields=None):
+        self.backend.call('jira', 'jira_search')
+        if jql_query.startswith("Project in (CAM) AND updated"):
+            return OfflineResultList([], 0)
+        cursor = re.search(r"key > \S+-(\d+)", jql_query)
+        tickets = sorted((ticket for ticket in self.backend.tickets if 'data_complete' not in ticket.fields.labels and
+                          (cursor is None or int(ticket.key.split('-')[-1]) > int(cursor.group(1)))),
+                         key=lambda ticket: int(ticket.key.split('-')[-1]))
+        page_size = min(maxResults, self.max_results or maxResults)
+        return OfflineResultList(tickets[startAt:startAt + page_size], len(tickets))
+
+
+class OfflineJiraManager(JiraManager):
+    backend = None
+
+    def __init__(self, url, jira_token, page_size=100):
+        self.jira = OfflineJiraClient(self.backend)
+        self.page_size = int(page_size)
+        self.search_fields = 'labels'
+        self.attn_default = 'retailanalytics'
+        self.transaction_data_alert = 'transaction data has been found '
+        self.missing_data_alert = 'transaction data is missing dates '
+        self.ticket_transitionid = '51'
+        self.comments = {}
+        self.gap_comments = {}
+
+    def update_ticket(self, issue_url, message, label=True):
+        self.backend.call('jira', 'jira_write_back')
+        ticket_key = issue_url.split('/')[-1]
+        if not label:
+            self.gap_comments[ticket_key] = message
+            return
+        with self.backend.lock:
+            self.backend.labelled_writes[ticket_key] = self.backend.labelled_writes.get(ticket_key, 0) + 1
+        self.comments[ticket_key] = message
+        for ticket in self.backend.tickets:
+            if ticket.key == ticket_key and u'data_complete' not in ticket.fields.labels:
+                ticket.fields.labels.append(u'data_complete')
+
+    def transition_ticket(self, issue_url):
+        self.backend.call('jira', 'jira_transition')
+
+    def kill_session(self):
+        pass
+
+
+class OfflineAPICallManager(object):
+    backend = None
+
+    def __init__(self, session=None, timeout=None):
+        self.session = session
+        self.timeout = timeout
+
+    @staticmethod
+    def create_session(pool_size=10, retries=3, backoff_factor=0.5):
+        return None
+
+    def api_call(self, api_url, arg):
+        try:
+            self.backend.call('api', 'api_call')
+        except IOError:
+            return None
+        if api_url.endswith('study/'):
+            parent = self.backend.studies.get(int(arg))
+            return {} if parent is None else {'parentCompanyId': parent}
+        provider = self.backend.accounts.get(int(arg))
+        return {} if provider is None else \
+            {'accountReferences': [{'referenceType': 'provider', 'referenceId': provider}]}
+
+    @staticmethod
+    def parent_id_fetch(call_dict):
+        return call_dict.get('parentCompanyId')
+
+    @staticmethod
+    def provider_id_fetch(call_dict):
+        for v_dict in call_dict.get('accountReferences', []):
+            if v_dict.get('referenceType') == 'provider':
+                return v_dict.get('referenceId')
+
+
+class OfflineQuboleManager(object):
+    backend = None
+
+    def __init__(self, name, qubole_token, cluster_label, query, poller=None, journal=None, engine='hive'):
+        self.name = name
+        self.cluster_label = cluster_label
+        self.query = query
+        self.queue_seconds = None
+
+    # Answers the single row coverage and probe queries
+    #
+    def get_results(self):
+        rows = self.get_result_rows()
+        row = next(iter(rows), None) if rows is not None else None
+        if row is None or None in row:
+            return None
+        return list(row)
+
+    # Answers every ProviderTransaction query shape, as written for hive, from the backend's provider transaction dates
+    #
+    def get_result_rows(self):
+        try:
+            self.backend.call('qubole', 'qubole_command')
+        except IOError:
+            return None
+        self.queue_seconds = 0.0
+        query = self.query
+        if 'latest_date' in query:
+            floor = re.search(r"txn_dt >=\('([^']+)'\)", query).group(1)
+            pids = re.search(r"provider_id IN \(([\d, ]+)\)", query)
+            pids = pids.group(1).split(', ') if pids else self.backend.provider_dates
+            return iter((int(pid), self.backend.dates(pid, floor)[-1]) for pid in pids
+                        if self.backend.dates(pid, floor))
+        if 'ticket_key' in query:
+            return iter(self.coverage_row(pid, pp_end, start, key) for key, pid, pp_end, start in re.findall(
+                r"select '([^']+)' as ticket_key, (\d+) as provider_id, '([^']+)' as pp_end_date, "
+                r"'([^']+)' as start_date", query) if self.backend.dates(pid, start))
+        if 'provider_id = ' in query:
+            return iter((int(pid), date) for pid, start in re.findall(r"provider_id = (\d+) AND txn_dt >=\('([^']+)'\)",
+                                                                      query)
+                        for date in self.backend.dates(pid, start))
+        pid = re.search(r"provider_id IN \((\d+)\)", query).group(1)
+        if 'limit 1' in query:
+            start, end = re.search(r"txn_dt >=\('([^']+)'\)\s+AND txn_dt <\('([^']+)'\)", query).groups()
+            return iter([(date,) for date in self.backend.dates(pid, start, end)[:1]])
+        pp_end, start = re.search(r"to_date\('([^']+)'\), to_date\('([^']+)'\)", query).groups()
+        return iter([self.coverage_row(pid, pp_end, start)])
+
+    # Builds one coverage row => [ticket key,] day count, distinct date count, min date, max date
+    #
+    def coverage_row(self, pid, pp_end, start, key=None):
+        dates = self.backend.dates(pid, start)
+        day_count = (datetime.strptime(pp_end, '%Y-%m-%d') - datetime.strptime(start, '%Y-%m-%d')).days + 1
+        row = (day_count, len(dates), dates[0] if dates else None, dates[-1] if dates else None)
+        return row if key is None else (key,) + row
+
+
+class OfflineEmailManager(object):
+    backend = None
+
+    def __init__(self, ticket, study_id, start_date, pp_end_date, subject, to_address, from_address):
+        self.ticket = ticket
+        self.details = "Ticket: {}\n\n".format(ticket.key)
+
+    @classmethod
+    def connect(cls):
+        cls.backend.call('email', 'email_connect')
+        return OfflineSmtp()
+
+    def retail_emailer(self, smtp=None):
+        try:
+            self.backend.call('email', 'email_sent')
+        except IOError:
+            return False
+        return True
+
+    @classmethod
+    def digest_emailer(cls, alerts, subject, to_address, from_address):
+        try:
+            cls.backend.call('email', 'email_digest')
+        except IOError:
+            return False
+        return True
+
+
+class OfflineSmtp(object):
+    def send_message(self, msg):
+        pass
+
+    def quit(self):
+        pass
+
+
+class OfflineCrawlerManager(DataCrawlerManager):
+    jira_class = OfflineJiraManager
+    api_class = OfflineAPICallManager
+    qubole_class = OfflineQuboleManager
+    email_class = OfflineEmailManager
+
+
+# Points every stand-in at the backend and returns an offline crawler manager for the configuration parameters
+#
+def offline_manager(backend, config_params):
+    for stand_in in (OfflineJiraManager, OfflineAPICallManager, OfflineQuboleManager, OfflineEmailManager):
+        stand_in.backend = backend
+    return OfflineCrawlerManager(config_params)
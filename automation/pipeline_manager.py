@@ -0,0 +1,68 @@
+# pipeline_manager module
+# Module holds the class => PipelineManager - manages a staged producer/consumer pipeline
+# Class responsible for feeding items from a source through a chain of stages, each stage with its own bounded queue
+# and worker count, so that later stages start work while earlier stages are still producing
+#
+import threading
+import queue
+import logging
+
+_END = object()
+
+
+class PipelineManager(object):
+    def __init__(self):
+        self.stages = []
+        self.logger = logging.getLogger(__name__)
+
+    # Adds a stage, handler is called with each item and returns the item for the next stage or None to drop it
+    #
+    def add_stage(self, name, handler, workers, queue_size):
+        self.stages.append((name, handler, int(workers), queue.Queue(maxsize=int(queue_size))))
+
+    # Feeds every item from the source through the stages, returns once all stages have drained
+    #
+    def run(self, source):
+        stage_threads = []
+        for index, (name, handler, workers, stage_queue) in enumerate(self.stages):
+            next_stage = self.stages[index + 1] if index + 1 < len(self.stages) else None
+            threads = [threading.Thread(target=self.work, name="{}-{}".format(name, number + 1),
+                                        args=(name, handler, stage_queue, next_stage), daemon=True)
+                       for number in range(workers)]
+            for thread in threads:
+                thread.start()
+            stage_threads.append(threads)
+
+        # the source is consumed on the calling thread, blocking while the first stage queue is full
+        first_name, first_handler, first_workers, first_queue = self.stages[0]
+        try:
+            for item in source:
+                first_queue.put(item)
+        except Exception as e:
+            self.logger.error("Pipeline source failed => {}".format(e))
+        finally:
+            # once a stage's workers have all finished, its successor is told to finish in turn
+            for _ in range(first_workers):
+                first_queue.put(_END)
+            for index, threads in enumerate(stage_threads):
+                for thread in threads:
+                    thread.join()
+                if index + 1 < len(self.stages):
+                    next_name, next_handler, next_workers, next_queue = self.stages[index + 1]
+                    for _ in range(next_workers):
+                        next_queue.put(_END)
+
+    # Stage worker loop, passes each handled item on to the next stage queue
+    #
+    def work(self, name, handler, stage_queue, next_stage):
+        while True:
+            item = stage_queue.get()
+            if item is _END:
+                return
+            try:
+                result = handler(item)
+            except Exception as e:
+                self.logger.error("Pipeline stage {} failed => {}".format(name, e))
+                continue
+            if result is not None and next_stage is not None:
+                next_stage[3].put(result)
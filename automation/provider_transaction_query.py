@@ -1,28 +1,255 @@
 # provider_transaction_query module
-# Module holds the class => ProviderTransaction - manages Hive query template
-# Class responsible to populate the query with api sourced variables
+# Module holds the class => ProviderTransaction - manages the transaction query templates
+# Class responsible to populate the query with api sourced variables, written in the SQL dialect of the engine that runs
+# it => hive (on Tez, the only engine given session settings), presto, spark or local (the embedded SQLite engine),
+# reading either the raw transaction table or the crawler's provider and transaction date summary table, and to build
+# the statements maintaining the summary table on hive or local
 #
 
+# per engine => session settings, probe settings, transaction table and the date expressions the templates use
+DIALECTS = {
+    'hive': {'settings': "set hive.execution.engine = tez;\n        set fs.s3n.block.size=128000000;\n"
+                         "        set fs.s3a.block.size=128000000;\n",
+             'probe_settings': "set hive.fetch.task.conversion = more;\n",
+             'table': "core_shared.transaction", 'day': "cast({} as date)", 'to_date': "to_date({})",
+             'datediff': "datediff({end}, {start})", 'bound': "('{}')",
+             'summary_table': "{schema}.{name}", 'summary_key': "cast(cast({} as date) as string)",
+             'summary_create': "CREATE TABLE IF NOT EXISTS {} (provider_id BIGINT, txn_count BIGINT) "
+                               "PARTITIONED BY (txn_date STRING) STORED AS ORC",
+             'summary_settings': "        set hive.exec.dynamic.partition = true;\n"
+                                 "        set hive.exec.dynamic.partition.mode = nonstrict;\n",
+             'summary_insert': "INSERT INTO TABLE {} PARTITION (txn_date)"},
+    'presto': {'settings': "", 'probe_settings': "",
+               'table': "core_shared.transaction", 'day': "cast({} as date)", 'to_date': "cast({} as date)",
+               'datediff': "date_diff('day', {start}, {end})", 'bound': " timestamp '{}'",
+               'summary_table': "{schema}.{name}"},
+    'spark': {'settings': "", 'probe_settings': "",
+              'table': "core_shared.transaction", 'day': "cast({} as date)", 'to_date': "to_date({})",
+              'datediff': "datediff({end}, {start})", 'bound': "('{}')",
+              'summary_table': "{schema}.{name}"},
+    'local': {'settings': "", 'probe_settings': "",
+              'table': "core_shared.\"transaction\"", 'day': "date({})", 'to_date': "date({})",
+              'datediff': "CAST(julianday({end}) - julianday({start}) AS INTEGER)", 'bound': "('{}')",
+              'summary_table': "core_shared.\"{name}\"", 'summary_key': "date({})",
+              'summary_create': "CREATE TABLE IF NOT EXISTS {} (provider_id INTEGER NOT NULL, txn_count INTEGER, "
+                                "txn_date TEXT NOT NULL, PRIMARY KEY (provider_id, txn_date))",
+              'summary_settings': "",
+              'summary_insert': "INSERT OR IGNORE INTO {} (provider_id, txn_count, txn_date)"},
+}
+
 
 class ProviderTransaction(object):
+    def __init__(self, engine='hive', summary_table=None):
+        self.engine = engine
+        self.dialect = DIALECTS[engine]
+        # the summary holds one row per provider and transaction date, already restricted to 'P' transactions
+        # the type restriction as a leading condition and as a following filter of the WHERE clause
+        if summary_table is None:
+            self.table = self.dialect['table']
+            self.txn_column = 'txn_dt'
+            self.type_condition = "txn_type = 'P'\n        AND "
+            self.type_filter = "\n        AND txn_type = 'P'"
+        else:
+            self.table = self.summary_name(summary_table)
+            self.txn_column = 'txn_date'
+            self.type_condition = ""
+            self.type_filter = ""
+        self.summary_table = summary_table
 
-    @staticmethod
-    def max_transact_date_query(provider_id, post_period_end_date, start_date):
+    def max_transact_date_query(self, provider_id, post_period_end_date, start_date):
         query = """
-        set hive.execution.engine = tez;
-        set fs.s3n.block.size=128000000;
-        set fs.s3a.block.size=128000000;
-
-        select datediff(to_date('{pp_end_date}'), to_date('{start_date}'))+1 as day_count,
+        {settings}
+        select {day_count}+1 as day_count,
         count(DISTINCT txn_date) as distinct_txn_count,
         MIN(txn_date) AS min_date,
         MAX(txn_date) AS max_date
-        from (select cast(txn_dt as date) as txn_date
-        from core_shared.transaction
-        WHERE provider_id IN ({pid})
-        AND txn_type = 'P'
-        AND txn_dt >=('{start_date}')
-        group by cast(txn_dt as date)
+        from (select {txn_day} as txn_date
+        from {table}
+        WHERE provider_id IN ({pid}){type_filter}
+        AND {txn_column} >={start_bound}
+        group by {txn_day}
         ) a
-        """.format(pid=provider_id, pp_end_date=post_period_end_date, start_date=start_date)
+        """.format(settings=self.dialect['settings'], table=self.table, txn_day=self.txn_day(),
+                   type_filter=self.type_filter, txn_column=self.txn_column,
+                   day_count=self.datediff(self.to_date("'{}'".format(post_period_end_date)),
+                                           self.to_date("'{}'".format(start_date))),
+                   pid=provider_id, start_bound=self.bound(start_date))
+        return query
+
+    # Builds a cheap probe that returns a single transaction date on or after the post-period end date, bounded above by
+    # the run date, on hive run as a fetch task so no Tez job is started when the data is not there yet
+    #
+    def probe_query(self, provider_id, post_period_end_date, end_date):
+        query = """
+        {settings}
+        select {txn_day} as txn_date
+        from {table}
+        WHERE provider_id IN ({pid}){type_filter}
+        AND {txn_column} >={pp_end_bound}
+        AND {txn_column} <{end_bound}
+        limit 1
+        """.format(settings=self.dialect['probe_settings'], table=self.table, txn_day=self.txn_day(),
+                   type_filter=self.type_filter, txn_column=self.txn_column,
+                   pid=provider_id, pp_end_bound=self.bound(post_period_end_date), end_bound=self.bound(end_date))
+        return query
+
+    # Builds a single query covering every (ticket, provider id, window) in the list, one output row per ticket
+    # windows: list of [ticket_key, provider_id, post_period_end_date, start_date]
+    #
+    def batch_coverage_query(self, windows):
+        window_rows = "\n        UNION ALL ".join(
+            "select '{key}' as ticket_key, {pid} as provider_id, '{pp_end_date}' as pp_end_date, "
+            "'{start_date}' as start_date".format(key=key, pid=pid, pp_end_date=pp_end_date, start_date=start_date)
+            for key, pid, pp_end_date, start_date in windows)
+        provider_ids = ", ".join(sorted(set(str(window[1]) for window in windows)))
+        earliest_start = min(window[3] for window in windows)
+        query = """
+        {settings}
+        select w.ticket_key,
+        {day_count}+1 as day_count,
+        count(DISTINCT t.txn_date) as distinct_txn_count,
+        MIN(t.txn_date) AS min_date,
+        MAX(t.txn_date) AS max_date
+        from (select provider_id, {txn_day} as txn_date
+        from {table}
+        WHERE provider_id IN ({pids}){type_filter}
+        AND {txn_column} >={start_bound}
+        group by provider_id, {txn_day}
+        ) t
+        join ({windows}
+        ) w
+        on t.provider_id = w.provider_id
+        WHERE t.txn_date >= {window_start}
+        group by w.ticket_key, w.provider_id, w.start_date, w.pp_end_date
+        """.format(settings=self.dialect['settings'], table=self.table, txn_day=self.txn_day(),
+                   type_filter=self.type_filter, txn_column=self.txn_column,
+                   day_count=self.datediff(self.to_date('w.pp_end_date'), self.to_date('w.start_date')),
+                   pids=provider_ids, start_bound=self.bound(earliest_start), windows=window_rows,
+                   window_start=self.to_date('w.start_date'))
+        return query
+
+    # Builds a single query returning the distinct transaction dates of each provider since its own scan start date
+    # provider_starts: dict of {provider_id: date from which the provider must be scanned}
+    #
+    def provider_dates_query(self, provider_starts):
+        provider_filters = "\n        OR ".join(
+            "(provider_id = {pid} AND {txn_column} >={start_bound})".format(pid=pid, txn_column=self.txn_column,
+                                                                            start_bound=self.bound(start_date))
+            for pid, start_date in sorted(provider_starts.items(), key=lambda item: str(item[0])))
+        query = """
+        {settings}
+        select provider_id, {txn_day} as txn_date
+        from {table}
+        WHERE provider_id IN ({pids}){type_filter}
+        AND {txn_column} >={start_bound}
+        AND ({filters})
+        group by provider_id, {txn_day}
+        """.format(settings=self.dialect['settings'], table=self.table, txn_day=self.txn_day(),
+                   type_filter=self.type_filter, txn_column=self.txn_column,
+                   pids=", ".join(sorted(str(pid) for pid in provider_starts)),
+                   start_bound=self.bound(min(provider_starts.values())), filters=provider_filters)
+        return query
+
+    # Builds a single lightweight aggregate returning the latest loaded transaction date of each provider since the
+    # floor date, restricted to the given provider ids when they are known
+    #
+    def watermark_query(self, floor_date, provider_ids=None):
+        provider_filter = "" if provider_ids is None else "\n        AND provider_id IN ({pids})".format(
+            pids=", ".join(sorted(set(str(pid) for pid in provider_ids))))
+        query = """
+        {settings}
+        select provider_id, MAX({txn_day}) AS latest_date
+        from {table}
+        WHERE {type_condition}{txn_column} >={floor_bound}{provider_filter}
+        group by provider_id
+        """.format(settings=self.dialect['settings'], table=self.table, txn_day=self.txn_day(),
+                   type_condition=self.type_condition, txn_column=self.txn_column,
+                   floor_bound=self.bound(floor_date), provider_filter=provider_filter)
         return query
+
+    # Builds the statement creating the summary table when it does not exist, partitioned by transaction date on hive
+    #
+    def summary_create_query(self, summary_table):
+        return self.dialect['summary_create'].format(self.summary_name(summary_table))
+
+    # Builds the statement appending to the summary table the 'P' transaction count of each provider and transaction
+    # date since the provider's scan start date, skipping the provider dates already summarized so that re-scanning a
+    # provider's latest date never duplicates it
+    # provider_starts: dict of {provider_id: date from which the provider must be scanned}
+    #
+    def summary_insert_query(self, summary_table, provider_starts):
+        provider_filters = "\n        OR ".join(
+            "(provider_id = {pid} AND txn_dt >={start_bound})".format(pid=pid, start_bound=self.bound(start_date))
+            for pid, start_date in sorted(provider_starts.items(), key=lambda item: str(item[0])))
+        pids = ", ".join(sorted(str(pid) for pid in provider_starts))
+        earliest_start = min(provider_starts.values())
+        query = """
+        {settings}{summary_settings}
+        {insert}
+        select t.provider_id, t.txn_count, t.txn_date
+        from (select provider_id, count(*) as txn_count, {txn_key} as txn_date
+        from {table}
+        WHERE provider_id IN ({pids})
+        AND txn_type = 'P'
+        AND txn_dt >={start_bound}
+        AND ({filters})
+        group by provider_id, {txn_key}
+        ) t
+        left join (select provider_id, txn_date
+        from {summary}
+        WHERE provider_id IN ({pids})
+        AND txn_date >=('{start_date}')
+        ) s
+        on t.provider_id = s.provider_id and t.txn_date = s.txn_date
+        WHERE s.provider_id IS NULL
+        """.format(settings=self.dialect['settings'], summary_settings=self.dialect['summary_settings'],
+                   insert=self.dialect['summary_insert'].format(self.summary_name(summary_table)),
+                   txn_key=self.dialect['summary_key'].format('txn_dt'), table=self.dialect['table'], pids=pids,
+                   start_bound=self.bound(earliest_start), filters=provider_filters,
+                   summary=self.summary_name(summary_table), start_date=earliest_start)
+        return query
+
+    # Builds a query returning the latest summarized transaction date of each of the given providers
+    #
+    def summary_high_water_query(self, summary_table, provider_ids):
+        query = """
+        {settings}
+        select provider_id, MAX(txn_date) AS high_water
+        from {summary}
+        WHERE provider_id IN ({pids})
+        group by provider_id
+        """.format(settings=self.dialect['settings'], summary=self.summary_name(summary_table),
+                   pids=", ".join(sorted(set(str(pid) for pid in provider_ids))))
+        return query
+
+    # Dialect expressions => the date of a timestamp column, the date of a literal or string column, the whole days
+    # between two dates and the right-hand side of a comparison against a transaction timestamp
+    #
+    def day(self, column):
+        return self.dialect['day'].format(column)
+
+    def to_date(self, value):
+        return self.dialect['to_date'].format(value)
+
+    def datediff(self, end, start):
+        return self.dialect['datediff'].format(end=end, start=start)
+
+    def bound(self, date):
+        # the summary's transaction date is a 'YYYY-MM-DD' string on every engine
+        if self.txn_column == 'txn_date':
+            return "('{}')".format(date)
+        return self.dialect['bound'].format(date)
+
+    # Returns the expression of a row's transaction date in the table read => the date of its timestamp in the
+    # transaction table, the date of its string in the summary
+    #
+    def txn_day(self):
+        if self.txn_column == 'txn_date':
+            return self.to_date('txn_date')
+        return self.day('txn_dt')
+
+    # Returns the summary table's name as written for the engine, on local a table of the attached database
+    #
+    def summary_name(self, summary_table):
+        schema, _, name = summary_table.rpartition('.')
+        return self.dialect['summary_table'].format(schema=schema, name=name)
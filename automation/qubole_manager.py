@@ -1,24 +1,66 @@
 # qubole_manager module
 # Module holds the class => QuboleManager - manages Qubole search interface
-# Class responsible for all Qubole related interactions including query launch and results retrieval
+# Class responsible for all Qubole related interactions including query launch and results retrieval, the qds_sdk is
+# only imported once a query is launched, with a run journal a command submitted by a run that died is reattached to
+# rather than submitted again, the command type follows the engine the query was written for => hive (on Tez), presto or
+# spark sql
 #
-from qds_sdk.commands import *
-import io
-from contextlib import redirect_stdout
+import time
 import logging
 
+from result_reader import ResultReader
+from metrics_manager import registry as metrics
+
+# qds_sdk command class of each engine
+COMMANDS = {'hive': 'HiveCommand', 'presto': 'PrestoCommand', 'spark': 'SparkCommand'}
+
 
 class QuboleManager(object):
-    def __init__(self, name, qubole_token, cluster_label, query):
+    def __init__(self, name, qubole_token, cluster_label, query, poller=None, journal=None, engine='hive'):
         self.name = name
         self.qubole_token = qubole_token
         self.cluster_label = cluster_label
         self.query = query
+        self.queue_seconds = None
+        self.poller = poller
+        self.journal = journal
+        self.engine = engine
+        self.command_key = None if journal is None else journal.command_key(name, query)
+        self.reader = ResultReader()
         self.logger = logging.getLogger(__name__)
 
     # Launches query, collects, converts and returns results
     #
     def get_results(self):
+        from qds_sdk.qubole import Qubole
+
+        Qubole.configure(api_token=self.qubole_token)
+        try:
+            # launches the qubole query
+            resp = self.launch_query()
+
+        except Exception as e:
+            self.logger.error("Query run failed => {}".format(e))
+
+        else:
+            if resp is None:
+                return None
+            # takes the first row of output from qubole as a list of typed values
+            rows = self.reader.rows(resp)
+            results = next(rows, None)
+            rows.close()
+            if self.journal is not None:
+                self.journal.consumed(self.command_key)
+            # return 'None' if max_date is null (indicates no results) else return the results
+            if results is None or None in results:
+                return None
+            return list(results)
+
+    # Launches a multi-row query, returns an iterator streaming the result rows as typed tuples, None on failure
+    #
+    def get_result_rows(self):
+        from qds_sdk.qubole import Qubole
+
         Qubole.configure(api_token=self.qubole_token)
         try:
             # launches the qubole query
@@ -28,37 +70,123 @@ class QuboleManager(object):
             self.logger.error("Query run failed => {}".format(e))
 
         else:
-            output = io.BytesIO()
-            with redirect_stdout(output):
-                resp.get_results(fp=output, inline=True)
-                output.seek(0)
-                # takes output from qubole, converts to ascii, strips whitespace then splits to form a list
-                results = (output.read()).decode("utf-8").strip().split('\t')
-                # return 'None' if max_date is null (indicates no results) else return the results
-                for item in results:
-                    if item == '\\N':
-                        return None
-                return results
-
-    # Launches query and checks periodically for completion
+            if resp is None:
+                return None
+            return self.consume(self.reader.rows(resp))
+
+    # Launches a statement that returns no rows, returns True once it has succeeded
+    #
+    def execute(self):
+        from qds_sdk.qubole import Qubole
+
+        Qubole.configure(api_token=self.qubole_token)
+        try:
+            resp = self.launch_query()
+        except Exception as e:
+            self.logger.error("Statement run failed => {}".format(e))
+            return False
+        if resp is None:
+            return False
+        if self.journal is not None:
+            self.journal.consumed(self.command_key)
+        return True
+
+    # Streams the result rows, marking the command's results as used in the journal once all have been read
+    #
+    def consume(self, rows):
+        for row in rows:
+            yield row
+        if self.journal is not None:
+            self.journal.consumed(self.command_key)
+
+    # Returns the qds_sdk command class of the query's engine
+    #
+    def command_class(self):
+        import qds_sdk.commands
+
+        return getattr(qds_sdk.commands, COMMANDS[self.engine])
+
+    # Submits the query as a command of its engine, spark sql takes the query text as its 'sql' argument
+    #
+    def create_command(self):
+        if self.engine == 'spark':
+            return self.command_class().create(sql=self.query, retry=3, label=self.cluster_label,
+                                               name=", ".join(self.name))
+        return self.command_class().create(query=self.query, retry=3, label=self.cluster_label,
+                                           name=", ".join(self.name))
+
+    # Launches query and checks for completion, through the shared poller when one is given
     #
     def launch_query(self):
+        command = self.command_class()
+
+        # a command left by a run that died is waited on or read again rather than paid for twice
+        resume = None if self.journal is None else self.journal.resumable(self.command_key)
+        if resume is not None:
+            resp = self.reattach(*resume)
+            if resp is not None:
+                return resp
+
         done = False
         attempt = 1
         while not done and attempt <= 3:
-            resp = HiveCommand.create(query=self.query, retry=3, label=self.cluster_label, name=", ".join(self.name))
-            final_status = self.watch_status(resp.id)
-            done = HiveCommand.is_success(final_status)
+            metrics.increment('hive_launch_attempts', retry='no' if attempt == 1 else 'yes')
+            started = time.time()
+            resp = self.create_command()
+            if self.journal is not None:
+                self.journal.submitted(self.command_key, self.name, resp.id)
+            if self.poller is not None:
+                final_status, self.queue_seconds = self.poller.wait(resp.id, command)
+            else:
+                final_status = self.watch_status(resp.id)
+            # record how long the command waited in the cluster queue versus ran, and how it ended
+            metrics.observe('hive_queue_seconds', self.queue_seconds or 0.0, cluster=self.cluster_label)
+            metrics.observe('hive_run_seconds', time.time() - started - (self.queue_seconds or 0.0),
+                            cluster=self.cluster_label)
+            metrics.increment('hive_command_status', status=final_status, cluster=self.cluster_label,
+                              engine=self.engine)
+            if self.journal is not None:
+                self.journal.finished(self.command_key, final_status)
+            done = command.is_success(final_status)
             attempt += 1
             if done:
                 return resp
 
-    # Monitors the Hive query status, returns when finished
+    # Reattaches to a journalled command, waiting for it when it was still in flight, returns the command once it has
+    # succeeded, else None so that the query is submitted afresh
     #
-    @ staticmethod
-    def watch_status(job_id):
-        cmd = HiveCommand.find(job_id)
-        while not HiveCommand.is_done(cmd.status):
+    def reattach(self, command_id, status):
+        command = self.command_class()
+
+        self.logger.info("Reattaching query {} to command {} ({})".format(", ".join(self.name), command_id,
+                                                                        status or 'in flight'))
+        try:
+            if status is None or not command.is_done(status):
+                if self.poller is not None:
+                    status, self.queue_seconds = self.poller.wait(command_id, command)
+                else:
+                    status = self.watch_status(command_id)
+                self.journal.finished(self.command_key, status)
+            metrics.increment('hive_commands_resumed', status=status)
+            if command.is_success(status):
+                return command.find(command_id)
+        except Exception as e:
+            self.logger.error("Reattaching to command {} failed => {}".format(command_id, e))
+        return None
+
+    # Monitors the command status, records how long the query waited in the cluster queue, returns when finished
+    #
+    def watch_status(self, job_id):
+        from qds_sdk.qubole import Qubole
+
+        command = self.command_class()
+        started = time.time()
+        cmd = command.find(job_id)
+        while not command.is_done(cmd.status):
+            if self.queue_seconds is None and cmd.status != 'waiting':
+                self.queue_seconds = time.time() - started
             time.sleep(Qubole.poll_interval)
-            cmd = HiveCommand.find(job_id)
+            cmd = command.find(job_id)
+        if self.queue_seconds is None:
+            self.queue_seconds = time.time() - started
         return cmd.status
@@ -0,0 +1,108 @@
+# query_coalescer module
+# Module holds the class => QueryCoalescer - manages the single-flight sharing of provider scans within a run
+# Class responsible for running one transaction date scan per provider for all the tickets whose windows it covers,
+# handing a ticket that arrives while a covering scan is in flight to that scan instead of submitting its own, and
+# splitting the scanned dates back out into each ticket's coverage results
+#
+from datetime import datetime
+import threading
+import logging
+
+from metrics_manager import registry as metrics
+
+
+class QueryCoalescer(object):
+    def __init__(self):
+        self.flights = {}
+        self.planned = {}
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    # Records a ticket window known before the scans start, so that the provider's scan starts early enough for all
+    #
+    def plan(self, provider_id, start_date):
+        with self.lock:
+            self.planned[str(provider_id)] = min(start_date, self.planned.get(str(provider_id), start_date))
+
+    # Calls back with the provider's transaction dates on or after start_date, None if the scan failed => straight away
+    # from a finished scan that covers the date, from the thread of an in-flight scan that covers it once that scan is
+    # done, so that no thread is held waiting on another's scan, else after running fetch(scan start) as the leader
+    # of a new scan, the leader then also calls back the tickets that joined its scan
+    #
+    def scan(self, provider_id, start_date, fetch, callback):
+        with self.lock:
+            flight = self.covering(provider_id, start_date)
+            leader = flight is None
+            finished = False
+            if leader:
+                flight = {'start': min(start_date, self.planned.get(str(provider_id), start_date)), 'dates': None,
+                          'done': threading.Event(), 'waiters': []}
+                self.flights.setdefault(str(provider_id), []).append(flight)
+            elif flight['done'].is_set():
+                finished = True
+            else:
+                flight['waiters'].append((start_date, callback))
+        metrics.increment('coalesced_scans', role='leader' if leader else 'follower')
+
+        if not leader:
+            if finished:
+                self.deliver(flight, start_date, callback)
+            else:
+                self.logger.info("Provider {} window from {} joins the scan from {}"
+                                 .format(provider_id, start_date, flight['start']))
+            return
+
+        try:
+            dates = fetch(flight['start'])
+            flight['dates'] = None if dates is None else sorted(dates)
+        except Exception as e:
+            self.logger.error("Scan of provider {} failed => {}".format(provider_id, e))
+        finally:
+            with self.lock:
+                flight['done'].set()
+                waiters, flight['waiters'] = flight['waiters'], []
+        self.deliver(flight, start_date, callback)
+        for waiter_start, waiter in waiters:
+            self.deliver(flight, waiter_start, waiter)
+
+    # Calls back with a finished scan's dates on or after start_date, a failing callback does not stop the others
+    #
+    def deliver(self, flight, start_date, callback):
+        try:
+            callback(None if flight['dates'] is None else [date for date in flight['dates'] if date >= start_date])
+        except Exception as e:
+            self.logger.error("Coalesced scan callback failed => {}".format(e))
+
+    # Returns True when a scan of the provider starting on or before start_date is in flight or finished
+    #
+    def covers(self, provider_id, start_date):
+        with self.lock:
+            return self.covering(provider_id, start_date) is not None
+
+    # Returns the finished scan dates of the provider on or after start_date without waiting, None if none covers it
+    #
+    def cached(self, provider_id, start_date):
+        with self.lock:
+            flight = self.covering(provider_id, start_date)
+        if flight is None or not flight['done'].is_set() or flight['dates'] is None:
+            return None
+        return [date for date in flight['dates'] if date >= start_date]
+
+    # Returns the scan of the provider that starts on or before start_date, called with the lock held
+    #
+    def covering(self, provider_id, start_date):
+        for flight in self.flights.get(str(provider_id), []):
+            if flight['start'] <= start_date:
+                return flight
+        return None
+
+    # Returns [day count, distinct transaction date count, min date, max date] for a ticket window from its scanned
+    # dates in the same shape as the per-ticket Hive coverage query, None when there are no dates
+    #
+    @staticmethod
+    def coverage(dates, post_period_end_date, start_date):
+        if not dates:
+            return None
+        day_count = (datetime.strptime(post_period_end_date, "%Y-%m-%d") -
+                     datetime.strptime(start_date, "%Y-%m-%d")).days + 1
+        return [day_count, len(dates), dates[0], dates[-1]]
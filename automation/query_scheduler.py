@@ -0,0 +1,109 @@
+# query_scheduler module
+# Module holds the class => QueryScheduler - manages the bounded, priority ordered launch of qubole queries
+# Class responsible for limiting the number of in-flight queries per cluster, adapting that limit to the observed
+# cluster queue times, launching the most overdue work first and sharing the work fairly across clusters
+#
+import itertools
+import threading
+import heapq
+import logging
+
+
+class QueryScheduler(object):
+    def __init__(self, worker, cluster_labels, max_in_flight, min_in_flight=1, target_queue_seconds=120):
+        # worker is called as worker(item, cluster_label) and returns the seconds the query waited in queue or None
+        self.worker = worker
+        self.cluster_labels = cluster_labels
+        self.max_in_flight = int(max_in_flight)
+        self.min_in_flight = min(int(min_in_flight), self.max_in_flight)
+        self.target_queue_seconds = float(target_queue_seconds)
+        self.limits = {label: self.max_in_flight for label in cluster_labels}
+        self.in_flight = {label: 0 for label in cluster_labels}
+        self.queue = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.closed = False
+        self.threads = []
+        self.logger = logging.getLogger(__name__)
+
+    # Starts one worker thread per possible in-flight slot
+    #
+    def start(self):
+        for number in range(self.max_in_flight * len(self.cluster_labels)):
+            thread = threading.Thread(target=self.work, name="Query-{}".format(number + 1), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    # Queues an item, items with the higher priority are launched first, equal priorities in submission order
+    #
+    def submit(self, item, priority=0):
+        with self.condition:
+            heapq.heappush(self.queue, (-priority, next(self.sequence), item))
+            self.condition.notify()
+
+    # Stops accepting work and waits for every queued item to finish
+    #
+    def join(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    # Convenience method to start, queue every item with its priority and wait for completion
+    #
+    def run(self, items, priority=lambda item: 0):
+        self.start()
+        for item in items:
+            self.submit(item, priority(item))
+        self.join()
+
+    # Returns the cluster with spare capacity that is least loaded relative to its limit, None if all are full
+    #
+    def pick_cluster(self):
+        open_clusters = [label for label in self.cluster_labels if self.in_flight[label] < self.limits[label]]
+        if not open_clusters:
+            return None
+        return min(open_clusters, key=lambda label: self.in_flight[label] / self.limits[label])
+
+    # Worker thread loop, takes the highest priority item once a cluster slot is free and runs it
+    #
+    def work(self):
+        while True:
+            with self.condition:
+                while True:
+                    cluster_label = self.pick_cluster() if self.queue else None
+                    if cluster_label is not None or (self.closed and not self.queue):
+                        break
+                    self.condition.wait()
+                if cluster_label is None:
+                    return
+                item = heapq.heappop(self.queue)[2]
+                self.in_flight[cluster_label] += 1
+
+            queue_seconds = None
+            try:
+                queue_seconds = self.worker(item, cluster_label)
+            except Exception as e:
+                self.logger.error("Scheduled query failed => {}".format(e))
+            finally:
+                with self.condition:
+                    self.in_flight[cluster_label] -= 1
+                    self.adapt(cluster_label, queue_seconds)
+                    self.condition.notify_all()
+
+    # Lowers a cluster's in-flight limit when queries queue longer than the target, raises it when they do not
+    #
+    def adapt(self, cluster_label, queue_seconds):
+        if queue_seconds is None:
+            return
+        limit = self.limits[cluster_label]
+        if queue_seconds > self.target_queue_seconds and limit > self.min_in_flight:
+            self.limits[cluster_label] = limit - 1
+            self.logger.info("Cluster {} queue time {:.0f}s, in-flight limit lowered to {}"
+                             .format(cluster_label, queue_seconds, limit - 1))
+        elif queue_seconds < self.target_queue_seconds / 2 and limit < self.max_in_flight:
+            self.limits[cluster_label] = limit + 1
+            self.logger.info("Cluster {} queue time {:.0f}s, in-flight limit raised to {}"
+                             .format(cluster_label, queue_seconds, limit + 1))
@@ -0,0 +1,115 @@
+# readiness_history module
+# Module holds the class => ReadinessHistory - manages the local history of ticket outcomes and provider data lags
+# Class responsible for recording when each ticket was checked and found incomplete or complete, keeping per provider
+# the number of days after the post-period end date its data was complete, and estimating from those lags the date
+# before which a new ticket of the provider is not worth querying, with a forced re-check cadence as a safety net
+#
+from datetime import datetime, timedelta
+import threading
+import sqlite3
+import logging
+
+
+class ReadinessHistory(object):
+    def __init__(self, db_path, lag_quantile=0.1, min_samples=5, max_defer_days=30, recheck_days=7,
+                 retention_days=365):
+        self.db_path = db_path
+        self.lag_quantile = float(lag_quantile)
+        self.min_samples = int(min_samples)
+        self.max_defer_days = int(max_defer_days)
+        self.recheck_days = int(recheck_days)
+        self.retention_days = int(retention_days)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.logger = logging.getLogger(__name__)
+        self.create_tables()
+
+    # Creates the check and lag tables if they do not already exist
+    #
+    def create_tables(self):
+        with self.lock, self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS ticket_checks ("
+                              "ticket_key TEXT PRIMARY KEY, provider_id TEXT NOT NULL, pp_end_date TEXT NOT NULL, "
+                              "last_checked TEXT NOT NULL, deferred_until TEXT)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS provider_lags ("
+                              "ticket_key TEXT PRIMARY KEY, provider_id TEXT NOT NULL, lag_days INTEGER NOT NULL, "
+                              "ready_date TEXT NOT NULL)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS provider_lags_provider ON provider_lags (provider_id)")
+
+    # Records the outcome of a ticket's check on the run date, a complete ticket adds a lag sample to its provider's
+    # history => the days from the post-period end date to the run that first found it complete, except when that run
+    # was the first one its deferral let through, since the deferral alone then set the lag and recording it would
+    # only confirm the estimate, a ticket found complete by a forced re-check or after being found incomplete past its
+    # expected ready date still gives a sample, so that the estimate can move both down and up
+    #
+    def record(self, ticket_key, provider_id, pp_end_date, run_date, complete):
+        with self.lock, self.conn:
+            if not complete:
+                self.conn.execute("INSERT OR REPLACE INTO ticket_checks (ticket_key, provider_id, pp_end_date, "
+                                  "last_checked, deferred_until) VALUES (?, ?, ?, ?, NULL)",
+                                  (ticket_key, str(provider_id), pp_end_date, run_date))
+                return
+            row = self.conn.execute("SELECT deferred_until FROM ticket_checks WHERE ticket_key = ?",
+                                    (ticket_key,)).fetchone()
+            self.conn.execute("DELETE FROM ticket_checks WHERE ticket_key = ?", (ticket_key,))
+            if row is not None and row[0] is not None and run_date >= row[0]:
+                return
+            self.conn.execute("INSERT OR REPLACE INTO provider_lags (ticket_key, provider_id, lag_days, ready_date) "
+                              "VALUES (?, ?, ?, ?)", (ticket_key, str(provider_id),
+                                                      max(0, self.days_between(pp_end_date, run_date)), run_date))
+
+    # Returns the expected lag in days of a provider's data after the post-period end date, the configured low
+    # quantile of its lag samples, None while the provider has too few samples to go by
+    #
+    def expected_lag(self, provider_id):
+        with self.lock:
+            lags = [row[0] for row in self.conn.execute(
+                "SELECT lag_days FROM provider_lags WHERE provider_id = ? ORDER BY lag_days", (str(provider_id),))]
+        if len(lags) < max(self.min_samples, 1):
+            return None
+        return min(lags[int(self.lag_quantile * (len(lags) - 1))], self.max_defer_days)
+
+    # Returns the tuple of (due, expected ready date) for a ticket on the run date => due once the expected ready date
+    # has been reached, when its provider has no usable history, or when it has not been checked for the re-check
+    # cadence, expected ready date None without history
+    #
+    def due(self, ticket_key, provider_id, pp_end_date, run_date):
+        lag = self.expected_lag(provider_id)
+        if lag is None:
+            return True, None
+        ready_date = (datetime.strptime(pp_end_date, '%Y-%m-%d') + timedelta(days=lag)).strftime('%Y-%m-%d')
+        if run_date >= ready_date:
+            return True, ready_date
+        # the safety net, a deferred ticket is checked at least once every re-check interval counted from the run that
+        # last checked it or first deferred it, the date it is deferred until is kept for its lag sample
+        with self.lock, self.conn:
+            row = self.conn.execute("SELECT last_checked FROM ticket_checks WHERE ticket_key = ?",
+                                    (ticket_key,)).fetchone()
+            if row is None:
+                self.conn.execute("INSERT INTO ticket_checks (ticket_key, provider_id, pp_end_date, last_checked, "
+                                  "deferred_until) VALUES (?, ?, ?, ?, ?)",
+                                  (ticket_key, str(provider_id), pp_end_date, run_date, ready_date))
+                return False, ready_date
+            self.conn.execute("UPDATE ticket_checks SET deferred_until = ? WHERE ticket_key = ?",
+                              (ready_date, ticket_key))
+        return self.days_between(row[0], run_date) >= self.recheck_days, ready_date
+
+    # Drops the checks and lag samples older than the retention period
+    #
+    def prune(self, run_date):
+        cutoff = (datetime.strptime(run_date, '%Y-%m-%d') - timedelta(days=self.retention_days)).strftime('%Y-%m-%d')
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM ticket_checks WHERE last_checked < ?", (cutoff,))
+            self.conn.execute("DELETE FROM provider_lags WHERE ready_date < ?", (cutoff,))
+
+    # Returns the whole days from the first to the second 'YYYY-MM-DD' date
+    #
+    @staticmethod
+    def days_between(first_date, second_date):
+        return (datetime.strptime(second_date[:10], '%Y-%m-%d') - datetime.strptime(first_date[:10], '%Y-%m-%d')).days
+
+    # Closes the history connection
+    #
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,20 @@
+# resource_pool module
+# Module holds the class => ResourcePool - manages the clients and caches shared by several crawler managers
+# Class responsible for handing out one instance per resource key, so that managers run for several configurations in
+# one process share their Jira client, api session pool, lookup cache, status poller, write-back queue and leases
+#
+import threading
+
+
+class ResourcePool(object):
+    def __init__(self):
+        self.resources = {}
+        self.lock = threading.Lock()
+
+    # Returns the resource held under the key, creating it with the factory on first use
+    #
+    def get(self, key, factory):
+        with self.lock:
+            if key not in self.resources:
+                self.resources[key] = factory()
+            return self.resources[key]
@@ -0,0 +1,38 @@
+# result_reader module
+# Module holds the class => ResultReader - manages the retrieval of Qubole command results
+# Class responsible for spooling a command's results to a private temporary file and streaming them back one row at
+# a time as typed tuples, so no output is held in memory and no process-wide stdout redirect is needed
+#
+import tempfile
+import logging
+
+NULL = '\\N'
+
+
+class ResultReader(object):
+    def __init__(self, spool_dir=None):
+        self.spool_dir = spool_dir
+        self.logger = logging.getLogger(__name__)
+
+    # Yields each result row of a finished command as a tuple of typed column values
+    #
+    def rows(self, cmd):
+        with tempfile.TemporaryFile(dir=self.spool_dir) as spool:
+            # the binary spool receives the utf-8 encoded results, inline or downloaded from the result location
+            cmd.get_results(fp=spool, inline=True)
+            spool.seek(0)
+            for line in spool:
+                line = line.decode('utf-8').rstrip('\r\n')
+                if line.strip():
+                    yield tuple(self.convert(value) for value in line.split('\t'))
+
+    # Converts a single column value, Hive nulls become None and whole numbers become int, all else stays a string
+    #
+    @staticmethod
+    def convert(value):
+        value = value.strip()
+        if value == NULL:
+            return None
+        if value.isdigit() or (value[:1] == '-' and value[1:].isdigit()):
+            return int(value)
+        return value
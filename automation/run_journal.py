@@ -0,0 +1,89 @@
+# run_journal module
+# Module holds the class => RunJournal - manages the durable journal of a run's Qubole commands and ticket stages
+# Class responsible for recording each command's id as soon as it is submitted and its final status, and each
+# ticket's stage, results and Jira write status, so that a run restarted after a crash reattaches to the commands it
+# had already submitted instead of paying for them twice, and skips the Jira writes that had already gone through
+#
+from hashlib import sha1
+import threading
+import sqlite3
+import json
+import time
+import logging
+
+FAILED_STATUSES = ('error', 'cancelled')
+
+
+class RunJournal(object):
+    def __init__(self, db_path, max_age_hours, retention_days):
+        self.db_path = db_path
+        self.max_age = float(max_age_hours) * 3600
+        self.retention = float(retention_days) * 86400
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.logger = logging.getLogger(__name__)
+        with self.lock, self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS commands ("
+                              "command_key TEXT PRIMARY KEY, name TEXT NOT NULL, command_id INTEGER NOT NULL, "
+                              "status TEXT, consumed INTEGER NOT NULL DEFAULT 0, submitted REAL NOT NULL)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS tickets ("
+                              "ticket_key TEXT PRIMARY KEY, stage TEXT NOT NULL, results TEXT, updated REAL NOT NULL)")
+            self.conn.execute("DELETE FROM commands WHERE submitted < ?", (time.time() - self.retention,))
+            self.conn.execute("DELETE FROM tickets WHERE updated < ?", (time.time() - self.retention,))
+
+    # Returns the journal key of a command, the same name and query text always give the same key
+    #
+    @staticmethod
+    def command_key(name, query):
+        return sha1("{}\n{}".format(", ".join(str(part) for part in name), query).encode('utf-8')).hexdigest()
+
+    # Returns the (command id, status) of a command submitted within the maximum age whose results have not yet been
+    # used, status None while the command was still in flight, or None when there is nothing to reattach to
+    #
+    def resumable(self, command_key):
+        with self.lock:
+            row = self.conn.execute("SELECT command_id, status FROM commands WHERE command_key = ? AND consumed = 0 "
+                                    "AND submitted >= ?", (command_key, time.time() - self.max_age)).fetchone()
+        if row is None or row[1] in FAILED_STATUSES:
+            return None
+        return row[0], row[1]
+
+    # Records a command as soon as Qubole has accepted it
+    #
+    def submitted(self, command_key, name, command_id):
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO commands (command_key, name, command_id, status, consumed, "
+                              "submitted) VALUES (?, ?, ?, NULL, 0, ?)",
+                              (command_key, ", ".join(str(part) for part in name), command_id, time.time()))
+
+    # Records the final status of a command
+    #
+    def finished(self, command_key, status):
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE commands SET status = ? WHERE command_key = ?", (status, command_key))
+
+    # Marks a command's results as used, a later run submits the query afresh
+    #
+    def consumed(self, command_key):
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE commands SET consumed = 1 WHERE command_key = ?", (command_key,))
+
+    # Records the stage a ticket has reached, with its query results when known
+    #
+    def record_ticket(self, ticket_key, stage, results=None):
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO tickets (ticket_key, stage, results, updated) VALUES (?, ?, ?, ?)",
+                              (ticket_key, stage, None if results is None else json.dumps(results), time.time()))
+
+    # Returns the stage a ticket last reached, None for a ticket not in the journal
+    #
+    def ticket_stage(self, ticket_key):
+        with self.lock:
+            row = self.conn.execute("SELECT stage FROM tickets WHERE ticket_key = ?", (ticket_key,)).fetchone()
+        return None if row is None else row[0]
+
+    # Closes the journal connection
+    #
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,83 @@
+# summary_registry module
+# Module holds the class => SummaryRegistry - manages the local registry of the providers kept in the summary table
+# Class responsible for recording the providers referenced by the open tickets' queries and the date from which each
+# is needed, the date from which each is covered by the summary table, and for dropping the providers no longer
+# referenced so that the summary is only maintained for the providers of open tickets
+#
+from datetime import datetime, timedelta
+import threading
+import sqlite3
+import logging
+
+
+class SummaryRegistry(object):
+    def __init__(self, db_path, retention_days=30):
+        self.db_path = db_path
+        self.retention_days = int(retention_days)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.logger = logging.getLogger(__name__)
+        self.create_tables()
+
+    # Creates the provider table if it does not already exist
+    #
+    def create_tables(self):
+        with self.lock, self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS summary_providers ("
+                              "provider_id TEXT PRIMARY KEY, covered_from TEXT, requested_from TEXT, "
+                              "requested_on TEXT NOT NULL)")
+
+    # Records that a query needs the provider's dates from start_date on, the request is only kept when the summary
+    # does not already cover the provider from that date
+    #
+    def request(self, provider_id, start_date, run_date):
+        provider_id = str(provider_id)
+        with self.lock, self.conn:
+            row = self.conn.execute("SELECT covered_from, requested_from FROM summary_providers WHERE provider_id = ?",
+                                    (provider_id,)).fetchone()
+            if row is None:
+                self.conn.execute("INSERT INTO summary_providers (provider_id, requested_from, requested_on) "
+                                  "VALUES (?, ?, ?)", (provider_id, start_date, run_date))
+                return
+            covered_from, requested_from = row
+            if covered_from is None or start_date < covered_from:
+                requested_from = start_date if requested_from is None else min(requested_from, start_date)
+            self.conn.execute("UPDATE summary_providers SET requested_from = ?, requested_on = ? WHERE provider_id = ?",
+                              (requested_from, run_date, provider_id))
+
+    # Returns {provider_id: date from which the provider is requested} for the providers waiting to be summarized
+    #
+    def pending(self):
+        with self.lock:
+            return {row[0]: row[1] for row in self.conn.execute(
+                "SELECT provider_id, requested_from FROM summary_providers WHERE requested_from IS NOT NULL")}
+
+    # Returns {provider_id: date from which the provider is summarized} for the providers in the summary
+    #
+    def covered(self):
+        with self.lock:
+            return {row[0]: row[1] for row in self.conn.execute(
+                "SELECT provider_id, covered_from FROM summary_providers WHERE covered_from IS NOT NULL")}
+
+    # Records the providers whose requested dates have been summarized
+    # provider_starts: dict of {provider_id: date from which the provider has been summarized}
+    #
+    def mark_covered(self, provider_starts):
+        with self.lock, self.conn:
+            for provider_id, start_date in provider_starts.items():
+                self.conn.execute("UPDATE summary_providers SET covered_from = min(coalesce(covered_from, ?), ?), "
+                                  "requested_from = NULL WHERE provider_id = ?",
+                                  (start_date, start_date, str(provider_id)))
+
+    # Drops the providers that no query has referenced within the retention period, returns how many were dropped
+    #
+    def prune(self, run_date):
+        cutoff = (datetime.strptime(run_date, '%Y-%m-%d') - timedelta(days=self.retention_days)).strftime('%Y-%m-%d')
+        with self.lock, self.conn:
+            return self.conn.execute("DELETE FROM summary_providers WHERE requested_on < ?", (cutoff,)).rowcount
+
+    # Closes the registry connection
+    #
+    def close(self):
+        with self.lock:
+            self.conn.close()
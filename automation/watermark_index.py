@@ -0,0 +1,41 @@
+# watermark_index module
+# Module holds the class => WatermarkIndex - manages the per-provider latest loaded transaction date of a run
+# Class responsible for holding the watermarks returned by the one lightweight watermark query of a run and answering,
+# for a ticket, whether its provider's data has been loaded through the post-period end date
+#
+import threading
+
+
+class WatermarkIndex(object):
+    def __init__(self, floor_date):
+        self.floor_date = floor_date
+        self.watermarks = None
+        self.loaded = threading.Event()
+
+    # Records the (provider id, latest transaction date) rows of the watermark query
+    #
+    def load(self, rows):
+        self.watermarks = {str(row[0]): row[1] for row in rows if row[1] is not None}
+        self.loaded.set()
+
+    # Marks the watermark query as failed, every ticket is then let through to its queries
+    #
+    def fail(self):
+        self.loaded.set()
+
+    # Returns True when the provider has data on or after the post-period end date, False when it does not, and None
+    # when the watermarks cannot tell, waiting for the watermark query to finish first unless wait is False, in which
+    # case None is returned while it is still running
+    #
+    def ready(self, provider_id, post_period_end_date, wait=True):
+        if wait:
+            self.loaded.wait()
+        elif not self.loaded.is_set():
+            return None
+        if self.watermarks is None:
+            return None
+        watermark = self.watermarks.get(str(provider_id))
+        if watermark is not None:
+            return watermark >= post_period_end_date
+        # a provider with no data since the floor date is only known to be short for windows ending after it
+        return False if post_period_end_date >= self.floor_date else None
@@ -0,0 +1,201 @@
+# writeback_manager module
+# Module holds the class => WriteBackManager - manages the asynchronous write-back of results to Jira
+# Class responsible for queueing each completed ticket's comment, 'data_complete' label and optional transition, or an
+# incomplete ticket's missing dates comment alone, as one coalesced write, sending the writes from a bounded set of
+# worker threads with retries, and persisting the pending writes to disk so that any write not yet confirmed by Jira is
+# replayed on the next run, with leases a confirmed write completes the ticket's lease and a replay is dropped once
+# another node has taken the ticket, with a run journal a replay is also dropped once the journal shows the write went
+# through before the pending file was updated
+#
+import threading
+import queue
+import json
+import time
+import os
+import logging
+
+from log_manager import ticket_scope
+from metrics_manager import registry as metrics
+
+
+class WriteBackManager(object):
+    def __init__(self, jira_pars, pending_path, workers, retries, backoff_seconds, leases=None, journal=None):
+        self.jira_pars = jira_pars
+        self.leases = leases
+        self.journal = journal
+        self.pending_path = pending_path
+        self.workers = int(workers)
+        self.retries = int(retries)
+        self.backoff_seconds = float(backoff_seconds)
+        self.writes = queue.Queue()
+        self.pending = {}
+        self.queued = set()
+        self.sending = set()
+        self.threads = []
+        self.users = 0
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    # Starts the writer threads and queues any writes left pending by an earlier run, a queue shared by several
+    # managers is started by the first of them
+    #
+    def start(self):
+        with self.lock:
+            self.users += 1
+            if self.users > 1:
+                return
+        if os.path.exists(self.pending_path):
+            with open(self.pending_path, 'r') as target:
+                replay = json.loads(target.read() or '{}')
+            if replay:
+                self.logger.info("Replaying {} pending Jira write(s) from {}: {}"
+                                 .format(len(replay), self.pending_path, sorted(replay)))
+            for ticket_key, write in replay.items():
+                if self.journal is not None and self.journal.ticket_stage(ticket_key) == 'written':
+                    self.logger.info("Pending Jira write for ticket {} already went through, it is dropped"
+                                     .format(ticket_key))
+                    continue
+                if write.get('label', True) and self.leases is not None and not self.leases.acquire(ticket_key):
+                    self.logger.warning("Pending Jira write for ticket {} dropped, the ticket has been taken by "
+                                        "another node".format(ticket_key))
+                    continue
+                self.put(ticket_key, write['issue_url'], write['message'], write['transition'],
+                         write.get('label', True))
+            # rewrite the pending file without the dropped writes
+            with self.lock:
+                self.save()
+        for number in range(self.workers):
+            thread = threading.Thread(target=self.work, name="JiraWriter-{}".format(number + 1), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    # Queues the write of a ticket, a write still waiting for the same ticket is replaced rather than sent twice, a
+    # write without the label only comments on a ticket that stays open
+    #
+    def put(self, ticket_key, issue_url, message, transition=False, label=True):
+        with self.lock:
+            previous = self.pending.get(ticket_key)
+            self.pending[ticket_key] = {'issue_url': issue_url, 'message': message,
+                                        'transition': transition or (previous is not None and previous['transition']),
+                                        'label': label or (previous is not None and previous.get('label', True))}
+            self.save()
+            if ticket_key in self.queued:
+                metrics.increment('jira_writes_coalesced')
+                return
+            self.queued.add(ticket_key)
+        self.writes.put(ticket_key)
+
+    # Queues again every pending write that is neither queued nor being sent, those that kept failing included, the
+    # service calls it at the start of each cycle so that a write is not left waiting for a restart after an outage
+    #
+    def requeue(self):
+        with self.lock:
+            ticket_keys = [ticket_key for ticket_key in self.pending
+                           if ticket_key not in self.queued and ticket_key not in self.sending]
+            self.queued.update(ticket_keys)
+        if ticket_keys:
+            self.logger.info("Retrying {} pending Jira write(s): {}".format(len(ticket_keys), sorted(ticket_keys)))
+        for ticket_key in ticket_keys:
+            self.writes.put(ticket_key)
+
+    # Returns True while a write for the ticket has not yet been confirmed by Jira
+    #
+    def is_pending(self, ticket_key):
+        with self.lock:
+            return ticket_key in self.pending
+
+    # Writer thread loop, sends each queued ticket's write and drops it from the pending file once Jira confirms it
+    #
+    def work(self):
+        while True:
+            ticket_key = self.writes.get()
+            if ticket_key is None:
+                break
+            with self.lock:
+                self.queued.discard(ticket_key)
+                write = self.pending.get(ticket_key)
+                if write is None:
+                    continue
+                self.sending.add(ticket_key)
+
+            sent = False
+            try:
+                with ticket_scope(ticket_key):
+                    sent = self.send(ticket_key, write)
+                # a comment alone leaves the ticket open, neither its journal stage nor its lease are completed
+                if sent and write.get('label', True):
+                    if self.journal is not None:
+                        self.journal.record_ticket(ticket_key, 'written')
+                    if self.leases is not None:
+                        self.leases.complete(ticket_key)
+            finally:
+                with self.lock:
+                    self.sending.discard(ticket_key)
+                    # keep a write that was replaced while this one was being sent, it is already queued again
+                    if sent and self.pending.get(ticket_key) is write:
+                        del self.pending[ticket_key]
+                        self.save()
+
+    # Sends one write with retries and a doubling backoff, returns True once Jira has accepted it, the comment and label
+    # are sent first and the transition on its own, a write whose comment went through is only retried from the
+    # transition so that the comment is not posted twice
+    #
+    def send(self, ticket_key, write):
+        for attempt in range(1, self.retries + 1):
+            try:
+                if not write.get('updated'):
+                    with metrics.span('jira_write', action='write_back'):
+                        self.jira_pars.update_ticket(write['issue_url'], write['message'], write.get('label', True))
+                    with self.lock:
+                        write['updated'] = True
+                        if self.pending.get(ticket_key) is write:
+                            self.save()
+                if write['transition']:
+                    with metrics.span('jira_write', action='transition'):
+                        self.jira_pars.transition_ticket(write['issue_url'])
+            except Exception as e:
+                metrics.increment('jira_write_retries')
+                self.logger.warning("Jira write for ticket {} failed on attempt {} of {} => {}"
+                                    .format(ticket_key, attempt, self.retries, e))
+                if attempt < self.retries:
+                    time.sleep(self.backoff_seconds * 2 ** (attempt - 1))
+            else:
+                if write.get('label', True):
+                    self.logger.info("Ticket {} has had its results comment added and its 'labels' field updated to "
+                                     "'data_complete'{}".format(ticket_key, ", and has been transitioned to the "
+                                                                            "'Analytics Processes' status"
+                                                                if write['transition'] else ""))
+                else:
+                    self.logger.info("Ticket {} has had its missing dates comment added".format(ticket_key))
+                return True
+
+        metrics.increment('jira_write_failures')
+        self.logger.error("Jira write for ticket {} kept failing, it is kept in {} and will be retried on the next "
+                          "cycle or run".format(ticket_key, self.pending_path))
+        return False
+
+    # Writes the pending writes through a temporary file and a rename, called with the lock held
+    #
+    def save(self):
+        temp_path = '{}.tmp'.format(self.pending_path)
+        with open(temp_path, 'w') as target:
+            target.write(json.dumps(self.pending, indent=2, sort_keys=True))
+        os.replace(temp_path, self.pending_path)
+
+    # Sends every queued write then stops the writer threads, writes that failed stay in the pending file, a queue
+    # shared by several managers is closed by the last of them
+    #
+    def close(self):
+        with self.lock:
+            self.users -= 1
+            if self.users > 0:
+                return
+        for _ in self.threads:
+            self.writes.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        with self.lock:
+            if self.pending:
+                self.logger.warning("{} Jira write(s) are still pending: {}".format(len(self.pending),
+                                                                                    sorted(self.pending)))